@@ -1,6 +1,7 @@
 #!python
 
 from datetime import datetime, timedelta
+from functools import lru_cache
 import json
 import os
 import pickle
@@ -15,10 +16,13 @@ from flask_wtf.csrf import validate_csrf, CSRFProtect
 
 from flask_executor import Executor
 import pandas as pd
-from pygris import block_groups
 from werkzeug.utils import secure_filename
 
-from tesca.analysis import CACHE_FOLDER, Analysis
+from tesca.analysis import BLOCK_GROUP_STORE_SUBFOLDER, CACHE_FOLDER, MAX_TIME, STAGE_STATUS, ZONES_FILENAME, Analysis
+from tesca.geometry_store import BlockGroupStore
+from tesca.jobs import JOBS_COLUMN, JobsTable
+from tesca.matrix import iter_matrix_csv, read_matrix_zones
+from tesca.metrics import threshold_comparison
 
 from config import DevelopmentConfig, ProductionConfig
 from forms import ConfigForm, OpportunitiesUploadForm
@@ -34,11 +38,48 @@ app.config["EXECUTOR_PROPAGATE_EXCEPTIONS"] = True
 csrf = CSRFProtect(app)
 executor = Executor(app)
 
+#: LODES job counts by block group
+JOBS_FILE = os.path.join("static", "data", "jobs.csv.gz")
+#: Number of rows formatted at a time when streaming a table as CSV
+CSV_ROW_CHUNK_SIZE = 10_000
+
 # ---------------------#
 ## UTILITY FUNCTIONS ##
 # ---------------------#
 
 
+@lru_cache(maxsize=None)
+def jobs_table() -> JobsTable:
+    """The job counts of every block group, read once per process
+
+    Returns
+    -------
+    JobsTable
+        The jobs table
+    """
+    return JobsTable.from_csv(JOBS_FILE)
+
+
+def iter_csv(df: pd.DataFrame, chunk_size: int = CSV_ROW_CHUNK_SIZE):
+    """Generate the CSV text of a dataframe a chunk of rows at a time
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The dataframe
+    chunk_size : int, optional
+        The number of rows to format at a time, by default ``CSV_ROW_CHUNK_SIZE``
+
+    Yields
+    ------
+    str
+        CSV text, starting with the header row
+    """
+    yield ",".join(df.columns) + "\n"
+    for start in range(0, df.shape[0], chunk_size):
+        yield df.iloc[start : start + chunk_size].to_csv(index=False, header=False)
+
+
 def run_validation(analysis_id: str):
     """Execute the validation process for a given analysis
 
@@ -65,23 +106,11 @@ def run_validation(analysis_id: str):
 def run_analysis(a: Analysis):
     print("Analysis run executed")
     try:
-        update_status(a.uid, "computing travel times", stage="run", value=0)
-        a.compute_travel_times()
-
-        update_status(a.uid, "computing metrics", value=60)
-        a.compute_metrics()
-
-        update_status(a.uid, "performing scenario comparison", value=70)
-        a.compare_scenarios()
-
-        update_status(a.uid, "downloading demographic data", value=80)
-        a.fetch_demographic_data()
-
-        update_status(a.uid, "computing demographic summaries", value=90)
-        a.compute_summaries()
-
-        update_status(a.uid, "computing unreachable destinations", value=95)
-        a.compute_unreachable()
+        a.run_pipeline(
+            on_stage=lambda stage: update_status(
+                a.uid, STAGE_STATUS[stage][0], stage="run", value=STAGE_STATUS[stage][1]
+            )
+        )
 
         update_status(a.uid, message="finished running analysis!", stage="results", value=100)
 
@@ -345,7 +374,6 @@ def counties():
         print(data_type)
         selected_counties = request.form.getlist("selected-counties")
         counties_by_state = {}
-        bg_dfs = []
         for county in selected_counties:
             state_fp = county[:2]
             county_fp = county[2:]
@@ -357,11 +385,12 @@ def counties():
         with open("settings.yml", "r") as infile:
             settings = yaml.safe_load(infile)
 
-        for state in counties_by_state.keys():
-            bgs = block_groups(state=state, county=counties_by_state[state], year=settings["census_year"], cb=False)
-            bg_dfs.append(bgs)
-
-        bg_df = pd.concat(bg_dfs, axis="index")
+        store = BlockGroupStore(
+            os.path.join(CACHE_FOLDER, BLOCK_GROUP_STORE_SUBFOLDER),
+            settings["census_year"],
+            download=settings.get("census_offline", False) is not True,
+        )
+        bg_df = store.by_counties(counties_by_state)
         bg_df = bg_df.rename(columns={"GEOID": "bg_id"})
         bg_df = bg_df[["bg_id", "geometry"]]
 
@@ -372,17 +401,15 @@ def counties():
                 headers={"Content-Disposition": "attachment;filename=block_groups.geojson"},
             )
         if data_type == "jobs":
-            jobs = pd.read_csv(os.path.join("static", "data", "jobs.csv.gz"), dtype={"bg_id": str, "C000": int})
-            bg_df = pd.merge(bg_df, jobs, on="bg_id", how="left")
-            bg_df["C000"] = bg_df["C000"].fillna(0).astype(int)
+            jobs = pd.DataFrame({"bg_id": bg_df["bg_id"], JOBS_COLUMN: jobs_table().lookup(bg_df["bg_id"])})
             return Response(
-                bg_df[["bg_id", "C000"]].to_csv(index=False),
+                iter_csv(jobs),
                 mimetype="text/csv",
                 headers={"Content-disposition": "attachment; filename=block_groups.csv"},
             )
         else:
             return Response(
-                bg_df[["bg_id"]].to_csv(index=False),
+                iter_csv(bg_df[["bg_id"]]),
                 mimetype="text/csv",
                 headers={"Content-disposition": "attachment; filename=block_groups.csv"},
             )
@@ -491,6 +518,37 @@ def gtfs(analysis_id):
     return render_template("gtfs.jinja2", gtfs=gtfs_json, analysis_id=analysis_id)
 
 
+@app.route("/matrix/<analysis_id>/<int:scenario_idx>")
+def matrix(analysis_id, scenario_idx):
+    # Matrices are stored in a binary format, so convert to CSV as it is downloaded
+    project_folder = os.path.join(CACHE_FOLDER, secure_filename(analysis_id))
+    origins, destinations = read_matrix_zones(os.path.join(project_folder, ZONES_FILENAME))
+    return Response(
+        iter_matrix_csv(os.path.join(project_folder, f"matrix{scenario_idx}.npy"), origins, destinations),
+        mimetype="text/csv",
+        headers={"Content-disposition": f"attachment; filename=matrix{scenario_idx}.csv"},
+    )
+
+
+@app.route("/curves/<analysis_id>/<opportunity>/<int:threshold>")
+def access_curves(analysis_id, opportunity, threshold):
+    # Any cumulative threshold is read off the stored access curves, without a re-run
+    project_folder = os.path.join(CACHE_FOLDER, secure_filename(analysis_id))
+    try:
+        config = get_config(secure_filename(analysis_id))
+        origins, _ = read_matrix_zones(os.path.join(project_folder, ZONES_FILENAME))
+        compared = threshold_comparison(
+            [os.path.join(project_folder, f"curves{idx}.npy") for idx in range(len(config["scenarios"]))],
+            origins,
+            config["opportunities"],
+            opportunity,
+            threshold,
+        )
+    except (KeyError, FileNotFoundError):
+        return "No access curves for this opportunity and threshold", 404
+    return Response(compared.to_csv(index=False), mimetype="text/csv")
+
+
 @app.route("/projects")
 def analyses():
     # Take a look at the cache folder
@@ -548,6 +606,7 @@ def results(analysis_id):
     opp_sentence = ", ".join(opp_list[:-2] + [" and ".join(opp_list[-2:])])
 
     unreachable = os.path.exists(os.path.join(CACHE_FOLDER, analysis_id, "unreachable.csv"))
+    curves = os.path.exists(os.path.join(CACHE_FOLDER, analysis_id, "curves0.npy"))
 
     return render_template(
         "results.jinja2",
@@ -558,6 +617,8 @@ def results(analysis_id):
         opp_params=opp_params,
         opp_sentence=opp_sentence,
         unreachable=unreachable,
+        curves=curves,
+        max_time=int(MAX_TIME.total_seconds() // 60),
     )
 
 
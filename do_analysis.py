@@ -4,12 +4,14 @@ import traceback
 
 import yaml
 
-from tesca.analysis import Analysis, CACHE_FOLDER
+from tesca.analysis import Analysis, CACHE_FOLDER, STAGE_STATUS
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-i", "--ID", help="Analysis id")
+parser.add_argument("-f", "--force", action="store_true", help="Rerun stages whose inputs are unchanged")
 args = parser.parse_args()
 analysis_id = args.ID
+force = args.force
 
 
 def update_status(analysis_id, message, stage=None, value=None):
@@ -35,23 +37,10 @@ def update_status(analysis_id, message, stage=None, value=None):
 try:
     a = Analysis.from_config_file(os.path.join("cache", analysis_id, "config.yml"))
 
-    update_status(a.uid, "computing travel times", stage="run", value=0)
-    a.compute_travel_times()
-
-    update_status(a.uid, "computing metrics", value=60)
-    a.compute_metrics()
-
-    update_status(a.uid, "performing scenario comparison", value=70)
-    a.compare_scenarios()
-
-    update_status(a.uid, "downloading demographic data", value=80)
-    a.fetch_demographic_data()
-
-    update_status(a.uid, "computing demographic summaries", value=90)
-    a.compute_summaries()
-
-    update_status(a.uid, "computing unreachable populations", value=90)
-    a.compute_unreachable()
+    a.run_pipeline(
+        force=force,
+        on_stage=lambda stage: update_status(a.uid, STAGE_STATUS[stage][0], stage="run", value=STAGE_STATUS[stage][1]),
+    )
 
     update_status(a.uid, message="finished running analysis!", stage="results", value=100)
 
@@ -0,0 +1,19 @@
+import argparse
+import os
+import traceback
+
+from tesca.analysis import Analysis, CACHE_FOLDER
+
+# Unknown arguments (such as --max-memory) are left for r5py to pick up
+parser = argparse.ArgumentParser()
+parser.add_argument("-i", "--ID", help="Analysis id")
+parser.add_argument("-s", "--scenario", type=int, help="Scenario index")
+args, _ = parser.parse_known_args()
+
+# Compute a single scenario's travel time matrix
+try:
+    a = Analysis.from_config_file(os.path.join(CACHE_FOLDER, args.ID, "config.yml"))
+    a.compute_scenario_travel_times(args.scenario)
+except Exception:
+    traceback.print_exc()
+    raise SystemExit(1)
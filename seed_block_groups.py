@@ -0,0 +1,32 @@
+import argparse
+import os
+
+import yaml
+
+from tesca.analysis import BLOCK_GROUP_STORE_SUBFOLDER, CACHE_FOLDER
+from tesca.geometry_store import BlockGroupStore
+
+parser = argparse.ArgumentParser(
+    description="Download block group geometries, e.g. for an offline server"
+)
+parser.add_argument("states", nargs="+", help="FIPS codes of the states to download")
+parser.add_argument(
+    "-y", "--year", type=int, help="Census year, by default the census_year setting"
+)
+parser.add_argument(
+    "-o",
+    "--overwrite",
+    action="store_true",
+    help="Download states that are already stored",
+)
+args = parser.parse_args()
+
+year = args.year
+if year is None:
+    with open("settings.yml", "r") as infile:
+        year = yaml.safe_load(infile)["census_year"]
+
+store = BlockGroupStore(os.path.join(CACHE_FOLDER, BLOCK_GROUP_STORE_SUBFOLDER), year)
+for state in args.states:
+    print(f"Downloading block groups of state {state}")
+    store.seed(state.zfill(2), overwrite=args.overwrite)
@@ -115,6 +115,7 @@ function loadCompareData() {
             const mapSelector = document.getElementById('map-select');
             const initialMetric = mapSelector.options[0].value
             updateMap(initialMetric)
+            updateThresholdSlider(initialMetric)
         })
 }
 
@@ -279,6 +280,70 @@ function mapSelectionChanged() {
     const mapSelector = document.getElementById('map-select');
     const selectedMetric = mapSelector.options[mapSelector.selectedIndex].value
     updateMap(selectedMetric)
+    updateThresholdSlider(selectedMetric)
+}
+
+/**
+ * Show the threshold slider for cumulative metrics, starting at the metric's threshold.
+ * @param {String} metric The metric selected for the map
+ */
+function updateThresholdSlider(metric) {
+    const slider = document.getElementById('threshold-slider');
+    // Analyses without access curves have no slider
+    if (slider == null) {
+        return
+    }
+    const method = metric.split("_").at(-1).at(0)
+    slider.hidden = method != 'c'
+    if (method == 'c') {
+        const threshold = metric.split("_").at(-1).slice(1)
+        document.getElementById('threshold-input').value = threshold
+        document.getElementById('threshold-value').textContent = threshold
+    }
+}
+
+/**
+ * Update the slider label while the threshold slider moves.
+ */
+function thresholdSliderMoved() {
+    const threshold = document.getElementById('threshold-input').value
+    document.getElementById('threshold-value').textContent = threshold
+}
+
+/**
+ * Map the selected opportunity within the slider's threshold, read off the access curves.
+ */
+function thresholdChanged() {
+    const mapSelector = document.getElementById('map-select');
+    const selectedMetric = mapSelector.options[mapSelector.selectedIndex].value
+    const opportunity = selectedMetric.split("_").slice(0, -1).join("_")
+    const threshold = document.getElementById('threshold-input').value
+    d3.csv("/curves/" + analysis_id + "/" + opportunity + "/" + threshold)
+        .then(function (data) {
+            data.forEach(d => {
+                if (d.bg_id in compareData) {
+                    Object.assign(compareData[d.bg_id], d)
+                }
+            })
+            const metric = opportunity + "_c" + threshold
+            selectThresholdOption(metric, threshold)
+            updateMap(metric)
+        })
+}
+
+/**
+ * Select the map selector option of a slider threshold, adding it if the analysis did not compute it.
+ * @param {String} metric The cumulative metric of the threshold
+ * @param {String} threshold The threshold, in minutes
+ */
+function selectThresholdOption(metric, threshold) {
+    const mapSelector = document.getElementById('map-select');
+    if (!Array.from(mapSelector.options).some(option => option.value == metric)) {
+        const selectedOption = mapSelector.options[mapSelector.selectedIndex]
+        const label = selectedOption.textContent.replace(/\s+/g, " ").trim().replace(/\(\d+ minutes\)$/, "(" + threshold + " minutes)")
+        mapSelector.add(new Option(label, metric), selectedOption.nextSibling)
+    }
+    mapSelector.value = metric
 }
 
 /**
@@ -352,6 +417,13 @@ function updateMap(metric) {
     let thisColor = null;
     bgLayer.setStyle(function (feature) {
 
+        // Zones outside the impact area have no results in impact area only analyses
+        if (!(feature.properties.bg_id in compareData)) {
+            return {
+                fillColor: nanColor,
+            }
+        }
+
         // Figure out if this is cumulative or not
         if (method == 'c') {
             let value0 = compareData[feature.properties.bg_id][metric + "_0"]
@@ -370,6 +442,10 @@ function updateMap(metric) {
         }
     })
     bgLayer.eachLayer(function (layer) {
+        if (!(layer.feature.properties.bg_id in compareData)) {
+            layer.bindPopup("Not computed (outside the impact area)")
+            return
+        }
         delta = compareData[layer.feature.properties.bg_id][metric + "_1-0"]
         layer.bindPopup("<b>Total Change</b>: " + styleNumbers(delta))
     })
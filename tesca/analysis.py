@@ -1,37 +1,66 @@
 """
-The analysis object is used to initalize and perform a comparative data analysis. 
+The analysis object is used to initalize and perform a comparative data analysis.
 It contains a number of validation and helper functions as well as analysis functions.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import datetime as dt
-from functools import reduce
-from itertools import combinations
+import hashlib
 import json
 import logging
 import os
 import pathlib
+import shutil
 import subprocess
+import sys
 import time
 from typing import List
 import yaml
 
+try:
+    import resource
+except ImportError:
+    # Peak memory is not reported where the resource module is unavailable
+    resource = None
+
 os.environ["USE_PYGEOS"] = "0"
 
 import geopandas as gpd
 from gtfslite import GTFS
 import pandas as pd
 import numpy as np
-from pygris import block_groups
-from pygris.data import get_census
 from r5py import TransportNetwork, TravelTimeMatrixComputer
 
-from .util import (
-    demographic_categories,
-    income_categories,
-    age_categories,
-    total_hhld,
-    zero_car_hhld,
+from .census import (
+    CENSUS_API_URL,
+    CENSUS_RETRIES,
+    CENSUS_WORKERS,
+    CensusClient,
+    fetch_demographics,
+)
+from .matrix import (
+    combine_matrices,
+    dense_matrix,
+    open_matrix,
+    read_matrix_zones,
+    write_matrix,
+    write_zones,
+)
+from .metrics import (
+    ORIGIN_CHUNK_SIZE,
+    MetricsEngine,
+    scenario_differences,
+    weighted_summaries,
+    curve_opportunities,
+    threshold_comparison,
 )
+from .metric_cache import MetricCache, column_hash
+from .census_cache import CensusCache
+from .centroid_index import CentroidIndex
+from .geometry_store import BlockGroupStore
+from .network_cache import NetworkCache
+from .zones import ZoneIndex, encode_geoids
+from .util import hash_file
 
 LOG_FORMATTER = logging.Formatter("%(name)-12s %(levelname)-8s %(message)s")
 LOG_CSV_FORMATTER = logging.Formatter(
@@ -46,6 +75,8 @@ VALIDATION_SUBFOLDER = "validation"
 GTFS_VALIDATION_SUBFOLDER = "gtfs_validation"
 #: Expected filename of the centroids for matrix generation
 CENTROIDS_FILENAME = "analysis_centroids.geojson"
+#: Filename of the zone index giving the row and column order of the matrices
+ZONES_FILENAME = "zones.csv"
 #: Output filename of compared access metrics
 COMPARED_FILENAME = "compared.csv"
 #: Expected input filename for demographic data
@@ -62,8 +93,56 @@ MASTER_POPULATION_WEIGHTED_CENTROIDS_LAYER = "centroids"
 MOBILITY_DATA_VALIDATOR_JAR = "gtfs-validator-4.0.0-cli.jar"
 #: Output filename of summary data
 SUMMARY_FILENAME = "summary.csv"
+#: Output filename of the population-weighted quantiles of each metric
+QUANTILES_FILENAME = "summary_quantiles.csv"
+#: Output filename of the population-weighted histograms of each metric
+HISTOGRAMS_FILENAME = "summary_histograms.csv"
+#: Quantiles of each metric summarized for every demographic group
+SUMMARY_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+#: Number of histogram bins summarizing each metric for every demographic group
+SUMMARY_HISTOGRAM_BINS = 20
+#: Output filename of unreachable population counts
+UNREACHABLE_FILENAME = "unreachable.csv"
 #: Settings location
 SETTINGS_FILENAME = "settings.yml"
+#: Subfolder of the cache folder holding serialized transport networks
+NETWORK_CACHE_SUBFOLDER = "networks"
+#: Default maximum size of the transport network cache, in gigabytes
+NETWORK_CACHE_SIZE_GB = 20
+#: Subfolder of the cache folder holding Census API responses
+CENSUS_CACHE_SUBFOLDER = "census"
+#: Default maximum size of the Census response cache, in megabytes
+CENSUS_CACHE_SIZE_MB = 500
+#: Subfolder of the cache folder holding block group geometries
+BLOCK_GROUP_STORE_SUBFOLDER = "block_groups"
+#: Subfolder of the cache folder indexing the population-weighted centroids
+CENTROID_INDEX_SUBFOLDER = "weighted_centroids"
+#: Subfolder of the project folder holding the stage input manifests
+MANIFEST_SUBFOLDER = "manifests"
+#: Subfolder of the project folder holding cached metric columns
+METRIC_CACHE_SUBFOLDER = "metric_cache"
+#: Subfolder of the project folder holding partially computed matrices
+CHECKPOINT_SUBFOLDER = "checkpoints"
+#: The analysis stages, in the order they are run
+PIPELINE_STAGES = [
+    "compute_travel_times",
+    "compute_metrics",
+    "compare_scenarios",
+    "fetch_demographic_data",
+    "compute_summaries",
+    "compute_unreachable",
+]
+#: Status message and progress percentage reported when each stage starts
+STAGE_STATUS = {
+    "compute_travel_times": ("computing travel times", 0),
+    "compute_metrics": ("computing metrics", 60),
+    "compare_scenarios": ("performing scenario comparison", 70),
+    "fetch_demographic_data": ("downloading demographic data", 80),
+    "compute_summaries": ("computing demographic summaries", 90),
+    "compute_unreachable": ("computing unreachable destinations", 95),
+}
+#: Script executed by each worker process when computing scenarios in parallel
+SCENARIO_WORKER_SCRIPT = "do_scenario.py"
 
 MAX_TIME = dt.timedelta(
     hours=2
@@ -115,6 +194,20 @@ class Analysis:
         if new_analysis == True:
             self.log.info(f"Started a new analysis with ID {self.uid}")
 
+        # File hashes keyed by path, size and modification time
+        self._file_hashes = dict()
+        # Tabular artifacts held in memory between stages, keyed by filename,
+        # with the size and modification time of their file (None while the
+        # file is still being written by this object)
+        self._artifacts = dict()
+        # Artifacts whose files are still being written, and the writes
+        self._pending_artifacts = set()
+        self._writes = []
+        # A single thread, so files are written in the order they are produced
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        # Built from the centroids the first time it is needed
+        self._zone_index = None
+
     @classmethod
     def from_config_file(cls, config_file):
         """Create an analysis object from a yaml configuration file.
@@ -170,6 +263,476 @@ class Analysis:
             self.log.addHandler(handler_error)
             self.log.setLevel(STREAM_LOG)
 
+    def _hash_cached_file(self, filename: str) -> str:
+        """Hash a file in the project folder, reusing the hash if it hasn't changed
+
+        Parameters
+        ----------
+        filename : str
+            The path of the file relative to the project folder
+
+        Returns
+        -------
+        str
+            The file hash, or None if the file does not exist
+        """
+        path = os.path.join(self.cache_folder, filename)
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key not in self._file_hashes:
+            self._file_hashes[key] = hash_file(path)
+        return self._file_hashes[key]
+
+    def stage_dependencies(self, stage: str):
+        """List the input files, configuration settings and outputs of a stage
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage, one of ``PIPELINE_STAGES``
+
+        Returns
+        -------
+        tuple
+            The input filenames, the subset of the configuration the stage
+            reads, and the output filenames, all relative to the project folder
+
+        Raises
+        ------
+        KeyError
+            Raised when the stage is not a known pipeline stage
+        """
+        n_scenarios = len(self.config["scenarios"])
+        matrices = [f"matrix{idx}.npy" for idx in range(n_scenarios)]
+        metrics = [f"metrics{idx}.csv" for idx in range(n_scenarios)]
+        opportunities = {
+            key: {"method": value["method"], "parameters": value["parameters"]}
+            for key, value in self.config["opportunities"].items()
+        }
+        demographics = list(self.config["demographics"].keys())
+
+        if stage == "compute_travel_times":
+            inputs = ["osm.pbf", CENTROIDS_FILENAME]
+            for idx in range(n_scenarios):
+                inputs += [
+                    os.path.relpath(g, self.cache_folder)
+                    for g in sorted(self.assemble_gtfs_files(idx))
+                ]
+            if self.config.get("impact_area_only", False) is True:
+                inputs.append(IMPACT_AREA_FILENAME)
+            config = {
+                "impact_area_only": self.config.get("impact_area_only", False),
+                "opportunity_destinations_only": self.config.get(
+                    "opportunity_destinations_only", False
+                ),
+                "max_time_walking": self.config["max_time_walking"],
+                "scenarios": [
+                    {
+                        "start_datetime": str(scenario["start_datetime"]),
+                        "duration": scenario["duration"],
+                        "transit_modes": scenario["transit_modes"],
+                    }
+                    for scenario in self.config["scenarios"]
+                ],
+            }
+            if config["opportunity_destinations_only"] is True:
+                inputs.append(OPPORTUNITIES_FILENAME)
+                config["opportunities"] = list(self.config["opportunities"].keys())
+            outputs = matrices + [ZONES_FILENAME]
+        elif stage == "compute_metrics":
+            inputs = matrices + [ZONES_FILENAME, OPPORTUNITIES_FILENAME]
+            config = {
+                "opportunities": opportunities,
+                "access_curves": self.config.get("access_curves", True),
+                "memory_lean": self.config.get("memory_lean", False),
+            }
+            outputs = metrics
+            if config["access_curves"] is True:
+                outputs += [f"curves{idx}.npy" for idx in range(n_scenarios)]
+        elif stage == "compare_scenarios":
+            inputs = metrics + [CENTROIDS_FILENAME]
+            config = {
+                "opportunities": opportunities,
+                "infinity_value": self.config["infinity_value"],
+                "memory_lean": self.config.get("memory_lean", False),
+            }
+            outputs = [COMPARED_FILENAME]
+        elif stage == "fetch_demographic_data":
+            inputs = [IMPACT_AREA_FILENAME]
+            config = {}
+            outputs = [DEMOGRAPHICS_FILENAME]
+        elif stage == "compute_summaries":
+            inputs = [
+                COMPARED_FILENAME,
+                DEMOGRAPHICS_FILENAME,
+                IMPACT_AREA_FILENAME,
+                CENTROIDS_FILENAME,
+            ]
+            config = {
+                "demographics": demographics,
+                "memory_lean": self.config.get("memory_lean", False),
+            }
+            outputs = [SUMMARY_FILENAME, QUANTILES_FILENAME, HISTOGRAMS_FILENAME]
+        elif stage == "compute_unreachable":
+            inputs = metrics + [
+                DEMOGRAPHICS_FILENAME,
+                IMPACT_AREA_FILENAME,
+                CENTROIDS_FILENAME,
+            ]
+            config = {"opportunities": opportunities, "demographics": demographics}
+            # The unreachable file is only written for travel time measures
+            outputs = []
+            for opportunity in opportunities.values():
+                if opportunity["method"] == "travel_time":
+                    outputs = [UNREACHABLE_FILENAME]
+        else:
+            raise KeyError(f"Invalid pipeline stage {stage}")
+        return inputs, config, outputs
+
+    def stage_manifest(self, stage: str, unhashed: List[str] = ()) -> dict:
+        """Build the manifest of a stage's current inputs
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage, one of ``PIPELINE_STAGES``
+        unhashed : List[str], optional
+            Inputs to leave unhashed for now, e.g. because their files are
+            still being written
+
+        Returns
+        -------
+        dict
+            A dictionary with the ``inputs`` file hashes and the ``config`` subset
+        """
+        inputs, config, _ = self.stage_dependencies(stage)
+        manifest = {
+            "inputs": {
+                filename: (
+                    None if filename in unhashed else self._hash_cached_file(filename)
+                )
+                for filename in inputs
+            },
+            "config": config,
+        }
+        # Round trip through JSON so it compares equal to a stored manifest
+        return json.loads(json.dumps(manifest, default=str))
+
+    def run_stage(self, stage: str, force: bool = False) -> bool:
+        """Run a pipeline stage unless its inputs are unchanged since the last run
+
+        A stage is skipped when its input file hashes and configuration subset
+        match the manifest written after its last successful run, and its output
+        files are still the ones it produced.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage, one of ``PIPELINE_STAGES``
+        force : bool, optional
+            Whether to run the stage even if it is up to date, by default False
+
+        Returns
+        -------
+        bool
+            True if the stage was run, False if it was skipped
+        """
+        manifest_folder = os.path.join(self.cache_folder, MANIFEST_SUBFOLDER)
+        if not os.path.exists(manifest_folder):
+            os.mkdir(manifest_folder)
+        manifest_file = os.path.join(manifest_folder, f"{stage}.json")
+
+        inputs, _, outputs = self.stage_dependencies(stage)
+        # Inputs produced earlier in this run may still be being written, and
+        # have to be recomputed from anyway
+        pending = [
+            filename for filename in inputs if filename in self._pending_artifacts
+        ]
+        # Hash the inputs before the stage reads them, so the manifest never
+        # records files that changed while the stage was running. Pending inputs
+        # are hashed once written, from the tables the stage read from memory.
+        manifest = self.stage_manifest(stage, unhashed=pending)
+
+        if force is False and len(pending) == 0 and os.path.exists(manifest_file):
+            with open(manifest_file) as infile:
+                previous = json.load(infile)
+            if (
+                previous["inputs"] == manifest["inputs"]
+                and previous["config"] == manifest["config"]
+                and previous["outputs"]
+                == {filename: self._hash_cached_file(filename) for filename in outputs}
+            ):
+                self.log.info(f"Skipping {stage}, its inputs have not changed")
+                return False
+        if os.path.exists(manifest_file):
+            # Remove the old manifest in case this run fails part way
+            os.remove(manifest_file)
+
+        getattr(self, stage)()
+        self.log_memory(stage)
+
+        # Record the manifest once the stage's files have all been written
+        self._writes.append(
+            self._writer.submit(
+                self._write_stage_manifest,
+                manifest,
+                pending,
+                outputs,
+                manifest_file,
+                list(self._writes),
+            )
+        )
+        return True
+
+    def _write_stage_manifest(
+        self,
+        manifest: dict,
+        pending: List[str],
+        outputs: List[str],
+        manifest_file: str,
+        writes: list,
+    ):
+        """Write the manifest of a stage that has run, unless a write failed"""
+        if any(write.exception() is not None for write in writes):
+            return
+        for filename in pending:
+            manifest["inputs"][filename] = self._hash_cached_file(filename)
+        manifest["outputs"] = {
+            filename: self._hash_cached_file(filename) for filename in outputs
+        }
+        with open(manifest_file, "w") as outfile:
+            json.dump(manifest, outfile, indent=2)
+
+    @staticmethod
+    def table_memory(df: pd.DataFrame) -> tuple:
+        """Measure the memory of a table, with and without memory-lean types
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The table
+
+        Returns
+        -------
+        tuple
+            The bytes the table uses, and the bytes it would use with 64-bit
+            numbers in place of 32-bit ones and strings in place of categories
+        """
+        usage = df.memory_usage(index=True, deep=True)
+        lean = int(usage.sum())
+        full = lean
+        for column in df.columns:
+            series = df[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # Expand one column at a time into the type of its categories
+                categories_dtype = series.cat.categories.dtype
+                widened = series.astype(categories_dtype).memory_usage(
+                    index=False, deep=True
+                )
+            elif series.dtype in (np.float32, np.int32):
+                widened = 8 * len(series)
+            else:
+                continue
+            full += widened - int(usage[column])
+        return lean, full
+
+    def log_memory(self, stage: str):
+        """Log the memory of the analysis so far
+
+        The memory of the tables held for later stages is reported, and in
+        memory-lean mode what they would take without it. The peak resident
+        set size includes the memory-mapped matrices and the R5 JVM, and is
+        reported for the analysis process and for its largest scenario worker
+        process.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage that just finished
+        """
+        lean, full = 0, 0
+        for df, _ in self._artifacts.values():
+            df_lean, df_full = self.table_memory(df)
+            lean += df_lean
+            full += df_full
+        if self.config.get("memory_lean", False) is True:
+            saved = 100 * (full - lean) / full if full > 0 else 0
+            self.log.info(
+                f"Tables in memory after {stage}: {lean / 2**20:.1f} MB, "
+                f"{full / 2**20:.1f} MB without memory_lean ({saved:.0f}% saved)"
+            )
+        else:
+            self.log.info(f"Tables in memory after {stage}: {lean / 2**20:.1f} MB")
+
+        if resource is None:
+            return
+        # Linux reports kilobytes, macOS bytes
+        unit = 1 if sys.platform == "darwin" else 2**10
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+        workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+        self.log.info(
+            f"Peak memory after {stage}: {own / 2**20:.0f} MB, "
+            f"largest scenario worker {workers / 2**20:.0f} MB"
+        )
+
+    def run_pipeline(self, force: bool = False, on_stage=None):
+        """Run every pipeline stage, handing tables between them in memory
+
+        Each stage reads the tables produced by earlier stages from memory, while
+        their CSV files are written in the background for the web interface and
+        downloads. All files are written by the time this returns.
+
+        Parameters
+        ----------
+        force : bool, optional
+            Whether to run stages even if they are up to date, by default False
+        on_stage : callable, optional
+            Called with the name of each stage before it runs, e.g. to report
+            progress
+        """
+        try:
+            for stage in PIPELINE_STAGES:
+                if on_stage is not None:
+                    on_stage(stage)
+                self.run_stage(stage, force=force)
+        finally:
+            self.flush_artifacts()
+
+    @property
+    def zone_index(self) -> ZoneIndex:
+        """The index of the analysis zones, built once from the centroids
+
+        Returns
+        -------
+        ZoneIndex
+            The analysis zones, in the order of the centroids file
+        """
+        if self._zone_index is None:
+            centroids = gpd.read_file(
+                os.path.join(self.cache_folder, CENTROIDS_FILENAME), dtype={"id": str}
+            )
+            self._zone_index = ZoneIndex(centroids["id"].astype(str))
+        return self._zone_index
+
+    @property
+    def metric_dtype(self) -> str:
+        """The floating point type metrics are computed and compared in
+
+        Returns
+        -------
+        str
+            ``float32`` in memory-lean mode, otherwise ``float64``
+        """
+        if self.config.get("memory_lean", False) is True:
+            return "float32"
+        return "float64"
+
+    def read_artifact(self, filename: str) -> pd.DataFrame:
+        """Read a tabular file in the project folder, from memory if possible
+
+        Parameters
+        ----------
+        filename : str
+            The path of the CSV file relative to the project folder
+
+        Returns
+        -------
+        pd.DataFrame
+            A copy of the table, with a string ``bg_id`` column. In memory-lean
+            mode ``bg_id`` is categorical, floats are 32-bit and integers that
+            fit are 32-bit.
+        """
+        path = os.path.join(self.cache_folder, filename)
+        key = None
+        if filename not in self._pending_artifacts:
+            stat = os.stat(path)
+            key = (stat.st_size, stat.st_mtime_ns)
+        if filename not in self._artifacts or self._artifacts[filename][1] != key:
+            if self.config.get("memory_lean", False) is True:
+                df = pd.read_csv(path, dtype={"bg_id": "category"})
+                floats = df.select_dtypes("float64").columns
+                df[floats] = df[floats].astype("float32")
+                integers = df.select_dtypes("int64").columns
+                limits = np.iinfo(np.int32)
+                fits = (df[integers].min() >= limits.min) & (
+                    df[integers].max() <= limits.max
+                )
+                df[integers[fits]] = df[integers[fits]].astype("int32")
+            else:
+                df = pd.read_csv(path, dtype={"bg_id": str})
+            self._artifacts[filename] = (df, key)
+        return self._artifacts[filename][0].copy()
+
+    def write_artifact(self, filename: str, df: pd.DataFrame, **kwargs):
+        """Keep a table in memory for later stages and write it in the background
+
+        Parameters
+        ----------
+        filename : str
+            The path of the CSV file relative to the project folder
+        df : pd.DataFrame
+            The table, which must not be modified afterwards
+        **kwargs
+            Passed on to :meth:`pandas.DataFrame.to_csv`
+        """
+        self._artifacts[filename] = (df, None)
+        self._pending_artifacts.add(filename)
+        self._writes.append(self._writer.submit(self._write_csv, filename, df, kwargs))
+
+    def _write_csv(self, filename: str, df: pd.DataFrame, kwargs: dict):
+        """Write a table, replacing its file only once it is complete"""
+        path = os.path.join(self.cache_folder, filename)
+        df.to_csv(f"{path}.tmp", **kwargs)
+        os.replace(f"{path}.tmp", path)
+
+    def flush_artifacts(self):
+        """Wait for every background write to finish
+
+        Tables stay in memory only while their files are unchanged, and are
+        dropped in memory-lean mode.
+
+        Raises
+        ------
+        Exception
+            The first error raised by a write
+        """
+        writes = self._writes
+        self._writes = []
+        self._pending_artifacts = set()
+        written = False
+        try:
+            for write in writes:
+                write.result()
+            written = True
+        finally:
+            lean = self.config.get("memory_lean", False) is True
+            for filename, (df, key) in list(self._artifacts.items()):
+                if key is not None and lean is False:
+                    continue
+                path = os.path.join(self.cache_folder, filename)
+                if written is False or lean is True or not os.path.exists(path):
+                    # Read the table back from its file if it is needed again
+                    del self._artifacts[filename]
+                else:
+                    # Only reuse the table while its file is the one written
+                    stat = os.stat(path)
+                    self._artifacts[filename] = (df, (stat.st_size, stat.st_mtime_ns))
+
+    def discard_artifact(self, filename: str):
+        """Forget a table held in memory, before its file is written directly
+
+        Parameters
+        ----------
+        filename : str
+            The path of the CSV file relative to the project folder
+        """
+        if filename in self._pending_artifacts:
+            # Make sure an earlier background write cannot replace the new file
+            self.flush_artifacts()
+        self._artifacts.pop(filename, None)
+
     def assemble_gtfs_files(self, scenario_idx: int) -> list:
         """Build a list of GTFS files for a given scenario for validation
 
@@ -197,36 +760,123 @@ class Analysis:
         return gtfs
 
     def compute_travel_times(self):
-        """Compute the travel times for the provided scenarios"""
+        """Compute the travel times for the provided scenarios
+
+        If ``parallel_scenarios`` is set in the configuration, each scenario is
+        computed in its own worker process (and JVM) instead of one after the
+        other. See :meth:`compute_travel_times_parallel`.
+        """
         self.log.info("Starting travel time matrix computations")
-        origins = gpd.read_file(
-            os.path.join(self.cache_folder, CENTROIDS_FILENAME), dtype={"id": str}
-        )
+        centroids, origins, destinations = self.routing_zones()
         self.log.debug(f"There are {origins.shape[0]} origins")
+        self.log.debug(f"There are {destinations.shape[0]} destinations")
+        # All matrices share the zone order of the centroids file
+        write_zones(
+            centroids["id"],
+            os.path.join(self.cache_folder, ZONES_FILENAME),
+            origins=origins["id"],
+            destinations=destinations["id"],
+        )
 
-        for idx, scenario in enumerate(self.config["scenarios"]):
-            gtfs = self.assemble_gtfs_files(idx)
-            self.log.info(f"{scenario['name']}: Building analysis network")
-            start_time = scenario["start_datetime"]
-            if not isinstance(start_time, dt.datetime):
-                start_time = dt.datetime.strptime(start_time, "%Y-%m-%d %H:%M")
+        if self.config.get("parallel_scenarios", False) is True:
+            self.compute_travel_times_parallel()
+        else:
+            for idx in range(len(self.config["scenarios"])):
+                self.compute_scenario_travel_times(idx, origins, destinations)
+        self.log.info(f"All travel times computed")
 
-            tn = TransportNetwork(
-                os.path.join(self.cache_folder, "osm.pbf"),
-                gtfs,
-            )
+    def routing_zones(self):
+        """Select the origin and destination centroids to route between
 
-            # Build the transport modes starting as always with walking
-            transport_modes = ["WALK"]
-            for tm in scenario["transit_modes"]:
-                transport_modes.append(tm)
+        By default every centroid is both an origin and a destination. If
+        ``impact_area_only`` is set in the configuration, only the centroids in
+        the impact area are used as origins, and metrics are only computed for
+        the impact area. If ``opportunity_destinations_only`` is set, only the
+        centroids with a nonzero count of at least one configured opportunity
+        are used as destinations, which leaves every metric unchanged.
 
-            self.log.debug(f"  Transport Modes: {', '.join(transport_modes)}")
+        Returns
+        -------
+        tuple
+            The analysis centroids, the origins and the destinations, each as a
+            GeoDataFrame in the order of the centroids file
+        """
+        centroids = gpd.read_file(
+            os.path.join(self.cache_folder, CENTROIDS_FILENAME), dtype={"id": str}
+        )
+        self._zone_index = ZoneIndex(centroids["id"].astype(str))
+        origins = centroids
+        destinations = centroids
+        if self.config.get("impact_area_only", False) is True:
+            impact_area = self.read_artifact(IMPACT_AREA_FILENAME)
+            origins = centroids[self.zone_index.mask(impact_area["bg_id"])]
+        if self.config.get("opportunity_destinations_only", False) is True:
+            opportunity_df = pd.read_csv(
+                os.path.join(self.cache_folder, OPPORTUNITIES_FILENAME),
+                dtype={"bg_id": str},
+            )
+            columns = list(self.config["opportunities"].keys())
+            has_opportunities = (opportunity_df[columns] > 0).any(axis="columns")
+            destinations = centroids[
+                self.zone_index.mask(opportunity_df.loc[has_opportunities, "bg_id"])
+            ]
+        return centroids, origins, destinations
+
+    def compute_scenario_travel_times(
+        self, scenario_idx: int, origins=None, destinations=None
+    ):
+        """Compute the travel time matrix for a single scenario
 
+        Parameters
+        ----------
+        scenario_idx : int
+            The index of the scenario in the configuration
+        origins : gpd.GeoDataFrame, optional
+            The origin centroids, selected with :meth:`routing_zones` if not provided
+        destinations : gpd.GeoDataFrame, optional
+            The destination centroids, selected with :meth:`routing_zones` if not
+            provided
+        """
+        if origins is None or destinations is None:
+            _, origins, destinations = self.routing_zones()
+        scenario = self.config["scenarios"][scenario_idx]
+        gtfs = self.assemble_gtfs_files(scenario_idx)
+        start_time = scenario["start_datetime"]
+        if not isinstance(start_time, dt.datetime):
+            start_time = dt.datetime.strptime(start_time, "%Y-%m-%d %H:%M")
+
+        # Build the transport modes starting as always with walking
+        transport_modes = ["WALK"]
+        for tm in scenario["transit_modes"]:
+            transport_modes.append(tm)
+
+        self.log.debug(f"  Transport Modes: {', '.join(transport_modes)}")
+
+        # Origins are routed in batches, each saved as soon as it is computed so
+        # that an interrupted run can pick up where it left off
+        batch_size = int(self.config.get("origin_batch_size") or len(origins)) or 1
+        checkpoint_folder = self.prepare_checkpoints(
+            scenario_idx, origins, destinations, batch_size
+        )
+        tn = None
+        batch_files = []
+        start = time.time()
+        for batch, batch_start in enumerate(range(0, len(origins), batch_size)):
+            batch_file = os.path.join(checkpoint_folder, f"batch{batch}.npy")
+            batch_files.append(batch_file)
+            if os.path.exists(batch_file):
+                self.log.debug(f"{scenario['name']}: Batch {batch} already computed")
+                continue
+
+            if tn is None:
+                self.log.info(f"{scenario['name']}: Building analysis network")
+                tn = self.build_transport_network(gtfs)
+
+            batch_origins = origins.iloc[batch_start : batch_start + batch_size]
             ttmc = TravelTimeMatrixComputer(
                 tn,
-                origins=origins,
-                destinations=origins,
+                origins=batch_origins,
+                destinations=destinations,
                 departure=start_time,
                 departure_time_window=dt.timedelta(minutes=int(scenario["duration"])),
                 max_time=MAX_TIME,
@@ -235,77 +885,379 @@ class Analysis:
                 ),
                 transport_modes=transport_modes,
             )
-            self.log.info(f"{scenario['name']}: Computing travel time matrix")
-            start = time.time()
-            travel_time_matrix = ttmc.compute_travel_times()
-            end = time.time()
-            self.log.info(f"{scenario['name']}: Matrix computation complete")
-            self.log.debug(
-                f"{scenario['name']}: Matrix computation took {end-start} seconds"
+            self.log.info(
+                f"{scenario['name']}: Computing travel time matrix for origins {batch_start + 1} to {batch_start + len(batch_origins)} of {len(origins)}"
             )
-            travel_time_matrix.to_csv(
-                os.path.join(CACHE_FOLDER, self.uid, f"matrix{idx}.csv"),
-                index=False,
+            travel_time_matrix = ttmc.compute_travel_times()
+            # Write to a temporary file first so a partial batch is never kept
+            write_matrix(
+                travel_time_matrix,
+                f"{batch_file}.tmp",
+                batch_origins["id"],
+                destinations["id"],
             )
-            self.log.debug(f"{scenario['name']}: Matrix written to matrix{idx}.csv")
-        self.log.info(f"All travel times computed")
+            os.replace(f"{batch_file}.tmp", batch_file)
+            del travel_time_matrix
+        end = time.time()
+        self.log.info(f"{scenario['name']}: Matrix computation complete")
+        self.log.debug(
+            f"{scenario['name']}: Matrix computation took {end-start} seconds"
+        )
+        combine_matrices(
+            batch_files,
+            os.path.join(CACHE_FOLDER, self.uid, f"matrix{scenario_idx}.npy"),
+        )
+        shutil.rmtree(checkpoint_folder)
+        self.log.debug(
+            f"{scenario['name']}: Matrix written to matrix{scenario_idx}.npy"
+        )
+
+    def prepare_checkpoints(
+        self, scenario_idx: int, origins, destinations, batch_size: int
+    ) -> str:
+        """Set up the checkpoint folder holding a scenario's computed origin batches
+
+        Batches left over from an interrupted run are kept only if they were
+        computed from the same inputs, zones, and batch size.
+
+        Parameters
+        ----------
+        scenario_idx : int
+            The index of the scenario in the configuration
+        origins : gpd.GeoDataFrame
+            The origin centroids
+        destinations : gpd.GeoDataFrame
+            The destination centroids
+        batch_size : int
+            The number of origins in each batch
+
+        Returns
+        -------
+        str
+            The path of the checkpoint folder
+        """
+        scenario = self.config["scenarios"][scenario_idx]
+        signature = {
+            "network": NetworkCache.key(
+                os.path.join(self.cache_folder, "osm.pbf"),
+                self.assemble_gtfs_files(scenario_idx),
+            ),
+            "start_datetime": str(scenario["start_datetime"]),
+            "duration": scenario["duration"],
+            "transit_modes": scenario["transit_modes"],
+            "max_time_walking": self.config["max_time_walking"],
+            "origins": hashlib.sha256("\n".join(origins["id"]).encode()).hexdigest(),
+            "destinations": hashlib.sha256(
+                "\n".join(destinations["id"]).encode()
+            ).hexdigest(),
+            "batch_size": batch_size,
+        }
+        signature = json.loads(json.dumps(signature))
+
+        checkpoint_folder = os.path.join(
+            self.cache_folder, CHECKPOINT_SUBFOLDER, f"matrix{scenario_idx}"
+        )
+        signature_file = os.path.join(checkpoint_folder, "signature.json")
+        if os.path.exists(signature_file):
+            with open(signature_file) as infile:
+                if json.load(infile) == signature:
+                    return checkpoint_folder
+            self.log.debug(f"{scenario['name']}: Discarding outdated batches")
+        if os.path.exists(checkpoint_folder):
+            shutil.rmtree(checkpoint_folder)
+        os.makedirs(checkpoint_folder)
+        with open(signature_file, "w") as outfile:
+            json.dump(signature, outfile)
+        return checkpoint_folder
+
+    def build_transport_network(self, gtfs: list) -> TransportNetwork:
+        """Build the transport network for a list of GTFS files
+
+        Networks are reloaded from the shared network cache when one was already
+        built from identical inputs. The cache size is set by the
+        ``network_cache_size_gb`` setting, and a size of 0 disables it.
+
+        Parameters
+        ----------
+        gtfs : list
+            A list of GTFS files to include in the network
+
+        Returns
+        -------
+        TransportNetwork
+            The transport network
+        """
+        osm_file = os.path.join(self.cache_folder, "osm.pbf")
+        cache_size = self.settings.get("network_cache_size_gb", NETWORK_CACHE_SIZE_GB)
+        if not cache_size:
+            return TransportNetwork(osm_file, gtfs)
+
+        network_cache = NetworkCache(
+            os.path.join(CACHE_FOLDER, NETWORK_CACHE_SUBFOLDER),
+            int(float(cache_size) * 2**30),
+            log=self.log,
+        )
+        return network_cache.get(osm_file, gtfs)
+
+    def compute_travel_times_parallel(self):
+        """Compute the travel time matrices with one worker process per scenario
+
+        Each worker runs ``do_scenario.py`` with its own JVM. The number of
+        concurrent workers, and the cores and Java heap given to each, are set by
+        the ``scenario_workers``, ``scenario_cores`` and ``scenario_memory``
+        configuration keys.
+
+        Raises
+        ------
+        RuntimeError
+            Raised when a worker fails or does not produce its matrix file
+        """
+        n_scenarios = len(self.config["scenarios"])
+        workers = self.config.get("scenario_workers") or n_scenarios
+        workers = max(1, min(int(workers), n_scenarios))
+        cores = self.config.get("scenario_cores") or max(
+            1, (os.cpu_count() or 1) // workers
+        )
+        memory = self.config.get("scenario_memory")
+
+        # Workers read their configuration from disk
+        self.write_config_file()
+
+        # Remove stale matrices so a failed worker can't go unnoticed
+        for idx in range(n_scenarios):
+            matrix_file = os.path.join(self.cache_folder, f"matrix{idx}.npy")
+            if os.path.exists(matrix_file):
+                os.remove(matrix_file)
+
+        env = os.environ.copy()
+        env["JAVA_TOOL_OPTIONS"] = " ".join(
+            [env.get("JAVA_TOOL_OPTIONS", ""), f"-XX:ActiveProcessorCount={cores}"]
+        ).strip()
+
+        def run_worker(idx):
+            command = [
+                sys.executable,
+                SCENARIO_WORKER_SCRIPT,
+                "--ID",
+                self.uid,
+                "--scenario",
+                str(idx),
+            ]
+            if memory is not None:
+                command += ["--max-memory", str(memory)]
+            self.log.debug(f"Starting worker for scenario {idx}: {' '.join(command)}")
+            return subprocess.run(command, env=env).returncode
+
+        self.log.info(
+            f"Computing {n_scenarios} scenarios in {workers} parallel workers with {cores} cores each"
+        )
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            returncodes = list(executor.map(run_worker, range(n_scenarios)))
+
+        for idx, scenario in enumerate(self.config["scenarios"]):
+            if returncodes[idx] != 0:
+                raise RuntimeError(
+                    f"{scenario['name']}: Worker exited with code {returncodes[idx]}"
+                )
+            if not os.path.exists(os.path.join(self.cache_folder, f"matrix{idx}.npy")):
+                raise RuntimeError(f"{scenario['name']}: Worker produced no matrix")
 
     def compute_metrics(self):
         """Compute the access to opportunity metrics using the calcualted matrices"""
-        # Now that the metrics are built...
+        origins, destinations = read_matrix_zones(
+            os.path.join(self.cache_folder, ZONES_FILENAME)
+        )
+        opportunity_df = pd.read_csv(
+            os.path.join(
+                self.cache_folder,
+                OPPORTUNITIES_FILENAME,
+            ),
+            dtype={"bg_id": str},
+        )
+        metric_cache = None
+        if self.config.get("metric_cache", True) is True:
+            metric_cache = MetricCache(
+                os.path.join(self.cache_folder, METRIC_CACHE_SUBFOLDER), self.log
+            )
+        metric_keys = set()
+        # Only the memoized path knows which cached columns are still in use
+        memoized = False
 
         for idx, scenario in enumerate(self.config["scenarios"]):
             self.log.info(f"Computing metrics for {scenario['name']}")
-            metrics = []
-            matrix = pd.read_csv(
-                os.path.join(self.cache_folder, f"matrix{idx}.csv"),
-                dtype={"from_id": str, "to_id": str, "travel_time": "float64"},
+            engine = MetricsEngine(
+                open_matrix(os.path.join(self.cache_folder, f"matrix{idx}.npy")),
+                origins,
+                destinations,
+                opportunity_df,
+                chunk_size=self.config.get("metrics_chunk_size", ORIGIN_CHUNK_SIZE),
+                dtype=self.metric_dtype,
             )
-            matrix.dropna(subset=["from_id", "to_id"])
-            opportunity_df = pd.read_csv(
-                os.path.join(
-                    self.cache_folder,
-                    OPPORTUNITIES_FILENAME,
-                ),
-                dtype={"bg_id": str},
-            )
-            for opportunity in self.config["opportunities"]:
-                if self.config["opportunities"][opportunity]["method"] == "cumulative":
-                    for threshold in self.config["opportunities"][opportunity][
-                        "parameters"
-                    ]:
-                        self.log.debug(
-                            f"{scenario['name']}: Computing {self.config['opportunities'][opportunity]['method']} ({threshold}) access to {self.config['opportunities'][opportunity]['name']}"
-                        )
-                        metric_df = Analysis.compute_cumulative_measure(
-                            matrix, opportunity_df, opportunity, threshold
-                        )
-                        self.log.debug(f"Result has {metric_df.shape[0]} rows.")
-                        metrics.append(metric_df)
-                elif (
-                    self.config["opportunities"][opportunity]["method"] == "travel_time"
-                ):
-                    for n in self.config["opportunities"][opportunity]["parameters"]:
+            metrics_file = os.path.join(self.cache_folder, f"metrics{idx}.csv")
+            if self.config.get("stream_metrics", False) is True:
+                self.discard_artifact(f"metrics{idx}.csv")
+                # Write each chunk of origins as soon as it is finished
+                with open(f"{metrics_file}.tmp", "w") as outfile:
+                    for chunk_idx, metrics in enumerate(
+                        engine.iter_compute(self.config["opportunities"])
+                    ):
                         self.log.debug(
-                            f"{scenario['name']}: Computing {self.config['opportunities'][opportunity]['method']} ({n}) access to {self.config['opportunities'][opportunity]['name']}"
-                        )
-                        metric_df = Analysis.compute_travel_time_measure(
-                            matrix, opportunity_df, opportunity, n=n
+                            f"{scenario['name']}: Finished metrics for chunk {chunk_idx}"
                         )
-                        self.log.debug(f"Result has {metric_df.shape[0]} rows.")
-                        metrics.append(metric_df)
-                else:
-                    raise KeyError(
-                        f"Invalid method specification {self.config['opportunities'][opportunity]['method']} for metrics calculation"
-                    )
-
-            # Merge all dataframes together.
-            metrics = reduce(lambda df1, df2: pd.merge(df1, df2, on="bg_id"), metrics)
-            metrics.to_csv(
-                os.path.join(self.cache_folder, f"metrics{idx}.csv"), index=False
-            )
+                        metrics.to_csv(outfile, index=False, header=chunk_idx == 0)
+                os.replace(f"{metrics_file}.tmp", metrics_file)
+            elif metric_cache is not None:
+                matrix_hash = hashlib.sha256(
+                    (
+                        self._hash_cached_file(f"matrix{idx}.npy")
+                        + self._hash_cached_file(ZONES_FILENAME)
+                    ).encode()
+                ).hexdigest()
+                metrics, keys = self.compute_memoized_metrics(
+                    engine, matrix_hash, opportunity_df, metric_cache
+                )
+                metric_keys |= keys
+                memoized = True
+                self.log.debug(f"Result has {metrics.shape[0]} rows.")
+                self.write_artifact(f"metrics{idx}.csv", metrics, index=False)
+            else:
+                metrics = engine.compute(self.config["opportunities"])
+                self.log.debug(f"Result has {metrics.shape[0]} rows.")
+                self.write_artifact(f"metrics{idx}.csv", metrics, index=False)
+
+            if self.config.get("access_curves", True) is True:
+                self.log.debug(f"{scenario['name']}: Computing access curves")
+                engine.write_access_curves(
+                    self.curve_opportunities(),
+                    int(MAX_TIME.total_seconds() // 60),
+                    os.path.join(self.cache_folder, f"curves{idx}.npy"),
+                )
             self.log.info(f"Finished computing metrics")
 
+        if memoized is True:
+            # Drop the columns of parameters and inputs no longer in use
+            metric_cache.evict(keep=metric_keys)
+
+    def compute_memoized_metrics(
+        self,
+        engine: MetricsEngine,
+        matrix_hash: str,
+        opportunity_df: pd.DataFrame,
+        metric_cache: MetricCache,
+    ):
+        """Compute the configured metrics, only computing columns not yet cached
+
+        Parameters
+        ----------
+        engine : MetricsEngine
+            The metrics engine of the scenario's matrix
+        matrix_hash : str
+            The hash of the scenario's matrix and zone index
+        opportunity_df : pd.DataFrame
+            The opportunities
+        metric_cache : MetricCache
+            The cache of metric columns
+
+        Returns
+        -------
+        tuple
+            The metrics dataframe, with a ``bg_id`` row per origin and a column per
+            metric in configuration order, and the set of cache keys it used
+        """
+        keys = dict()
+        missing = dict()
+        columns = {"bg_id": engine.origins}
+        for opportunity, settings in self.config["opportunities"].items():
+            opportunity_hash = column_hash(opportunity_df, opportunity)
+            method = "c" if settings["method"] == "cumulative" else "t"
+            for parameter in settings["parameters"]:
+                metric = f"{opportunity}_{method}{parameter}"
+                keys[metric] = MetricCache.key(
+                    matrix_hash,
+                    opportunity_hash,
+                    settings["method"],
+                    parameter,
+                    engine.dtype.name,
+                )
+                columns[metric] = metric_cache.get(keys[metric])
+                if columns[metric] is None:
+                    missing.setdefault(
+                        opportunity,
+                        {"method": settings["method"], "parameters": []},
+                    )["parameters"].append(parameter)
+
+        if len(missing) > 0:
+            computed = engine.compute(missing)
+            self.log.debug(f"Computed {computed.shape[1] - 1} uncached metrics")
+            for metric in computed.columns[1:]:
+                columns[metric] = computed[metric].to_numpy()
+                metric_cache.put(keys[metric], columns[metric])
+        return pd.DataFrame(columns), set(keys.values())
+
+    def curve_opportunities(self) -> List[str]:
+        """List the opportunities with access curves, in the order they are stored
+
+        Returns
+        -------
+        List[str]
+            The names of the opportunities with a cumulative method
+        """
+        return curve_opportunities(self.config["opportunities"])
+
+    def threshold_comparison(self, opportunity: str, threshold: int) -> pd.DataFrame:
+        """Compare the cumulative access to an opportunity within any threshold
+
+        The measures are read off the access curves stored by
+        :meth:`compute_metrics`, so any threshold up to ``MAX_TIME`` is available
+        without recomputing the metrics.
+
+        Parameters
+        ----------
+        opportunity : str
+            The name of an opportunity with a cumulative method
+        threshold : int
+            The travel time threshold, in minutes
+
+        Returns
+        -------
+        pd.DataFrame
+            A dataframe in the format of the comparison file, with a ``bg_id`` row
+            per origin, a ``{opportunity}_c{threshold}_{idx}`` column for each
+            scenario and a ``{opportunity}_c{threshold}_{b}-{a}`` column for every
+            pair of scenarios
+
+        Raises
+        ------
+        KeyError
+            Raised when the opportunity has no access curves or the threshold is
+            outside them
+        """
+        origins, _ = read_matrix_zones(os.path.join(self.cache_folder, ZONES_FILENAME))
+        return threshold_comparison(
+            [
+                os.path.join(self.cache_folder, f"curves{idx}.npy")
+                for idx in range(len(self.config["scenarios"]))
+            ],
+            origins,
+            self.config["opportunities"],
+            opportunity,
+            threshold,
+        )
+
+    @staticmethod
+    def _long_matrix_engine(
+        matrix: pd.DataFrame, opportunity_df: pd.DataFrame, opportunity_name: str
+    ) -> MetricsEngine:
+        """Wrap a long-format travel time matrix in a metrics engine"""
+        origins = np.unique(matrix["from_id"].astype(str))
+        destinations = np.unique(matrix["to_id"].astype(str))
+        return MetricsEngine(
+            dense_matrix(matrix, origins, destinations),
+            origins,
+            destinations,
+            opportunity_df[["bg_id", opportunity_name]],
+        )
+
     @staticmethod
     def compute_cumulative_measure(
         matrix: pd.DataFrame,
@@ -315,10 +1267,13 @@ class Analysis:
     ) -> pd.DataFrame:
         """Calcualte the cumulative number of opportunities for each origin within the destination threshold.
 
+        This is :meth:`MetricsEngine.cumulative` for a long-format matrix, the
+        pipeline itself uses the engine on the stored dense matrices.
+
         Parameters
         ----------
         matrix : pd.DataFrame
-            The travel time matrix
+            The travel time matrix, with ``from_id``, ``to_id`` and ``travel_time`` columns
         opportunity_df : pd.DataFrame
             The opportunity locations
         opportunity_name : str
@@ -329,27 +1284,10 @@ class Analysis:
         Returns
         -------
         pd.DataFrame
-            A dataframe containing each origin and a count of reachable opportunities
+            A dataframe containing each origin of the matrix and a count of reachable opportunities
         """
-        # Keep only travel times under the threshold
-        matrix = matrix[matrix["travel_time"] <= threshold]
-        # Joining matrix in
-        mx_opportunity = pd.merge(
-            matrix, opportunity_df, left_on="to_id", right_on="bg_id"
-        )
-        result = (
-            mx_opportunity[["from_id", opportunity_name]]
-            .groupby("from_id", as_index=False)
-            .sum()
-        )
-        result.columns = ["bg_id", f"{opportunity_name}_c{threshold}"]
-
-        # Ensure we return a complete dataframe
-        result = pd.merge(result, opportunity_df[["bg_id"]], how="right")
-        result[f"{opportunity_name}_c{threshold}"] = result[
-            f"{opportunity_name}_c{threshold}"
-        ].fillna(0)
-        return result
+        engine = Analysis._long_matrix_engine(matrix, opportunity_df, opportunity_name)
+        return engine.cumulative({opportunity_name: [threshold]})
 
     @staticmethod
     def compute_travel_time_measure(
@@ -360,100 +1298,75 @@ class Analysis:
     ) -> pd.DataFrame:
         """Calculate travel time to nth nearest destination
 
+        This is :meth:`MetricsEngine.travel_time` for a long-format matrix, the
+        pipeline itself uses the engine on the stored dense matrices.
+
         Parameters
         ----------
         matrix : pd.DataFrame
-            A dataframe containing the travel time matrix
+            A dataframe containing the travel time matrix, with ``from_id``, ``to_id`` and ``travel_time`` columns
         opportunty_df : pd.DataFrame
             A dataframe containing the opportunities (1 or greater indicates opportunity is located there)
         opportunity_name : str
             The name of the opportunity to be used in the header. This will be appended with a '_tn' where n is as described below.
-        infinity_value : int
-            The value to use for infinite travel times
         n : int, optional
             The nth nearest item to use (e.g. 1 is closest, 3 is 3rd closest), by default 1
 
         Returns
         -------
         pd.DataFrame
-            A dataframe containing the minimum travel time to the nth nearest destination for each origin
+            A dataframe containing the minimum travel time to the nth nearest destination for each origin of the
+            matrix, NaN when fewer than n are reachable
         """
-
-        # First we perform a many-to-one join on the destinations
-        matrix_dest = pd.merge(
-            matrix,
-            opportunty_df[["bg_id", opportunity_name]],
-            left_on="to_id",
-            right_on="bg_id",
-            how="right",
-        )
-        matrix_dest = matrix_dest[matrix_dest[opportunity_name] > 0]
-        matrix_dest = matrix_dest.sort_values(
-            ["from_id", "travel_time"], ascending=True, na_position="last"
-        )
-
-        def get_nth(df, o, n):
-            df = df.sort_values(by="travel_time", ascending=True)
-            df["cumsum"] = df[o].cumsum()
-            df = df[df["cumsum"] >= n]
-            return df["travel_time"].min()
-
-        result = (
-            matrix_dest[["from_id", "travel_time", opportunity_name]]
-            .groupby("from_id", as_index=False)
-            .apply(get_nth, o=opportunity_name, n=n)
-        )
-        result.columns = ["bg_id", f"{opportunity_name}_t{n}"]
-        return result
+        engine = Analysis._long_matrix_engine(matrix, opportunty_df, opportunity_name)
+        return engine.travel_time({opportunity_name: [n]})
 
     def compute_unreachable(self):
         """Compute the number of individuals in the impact area who cannot reach their desired travel time destination"""
 
         self.log.info("Computing unreachable destinations")
         # Grab the "metrics" file for each one
-        demographics = pd.read_csv(
-            os.path.join(self.cache_folder, DEMOGRAPHICS_FILENAME), dtype={"bg_id": str}
-        )
-        impact_area = pd.read_csv(
-            os.path.join(self.cache_folder, IMPACT_AREA_FILENAME), dtype={"bg_id": str}
-        )
+        demographics = self.read_artifact(DEMOGRAPHICS_FILENAME)
+        impact_area = self.read_artifact(IMPACT_AREA_FILENAME)
 
-        unreachable_dfs = []
-        for idx, scenario in enumerate(self.config["scenarios"]):
-            metrics = pd.read_csv(
-                os.path.join(self.cache_folder, f"metrics{idx}.csv"),
-                dtype={"bg_id": str},
+        groups = list(self.config["demographics"].keys())
+        travel_time_columns = []
+        for opportunity in self.config["opportunities"]:
+            if self.config["opportunities"][opportunity]["method"] == "travel_time":
+                for parameter in self.config["opportunities"][opportunity][
+                    "parameters"
+                ]:
+                    travel_time_columns.append(f"{opportunity}_t{parameter}")
+
+        if len(travel_time_columns) > 0:
+            unreachable_dfs = []
+            # Align the demographics to the impact area zones
+            population, has_demographics = self.zone_index.align(demographics, groups)
+            in_impact_area = (
+                self.zone_index.mask(impact_area["bg_id"]) & has_demographics
             )
-            # Shrink file to the analysis area
-            metrics = metrics[metrics["bg_id"].isin(impact_area["bg_id"])]
-            # Let's join the metrics with the demographics now
-            metrics_demo = pd.merge(metrics, demographics, on="bg_id")
-
-            # If the measure is travel time, let's find the unreachables
-            for opportunity in self.config["opportunities"]:
-                if self.config["opportunities"][opportunity]["method"] == "travel_time":
-                    for parameter in self.config["opportunities"][opportunity][
-                        "parameters"
-                    ]:
-                        # Filter dataframe to only keep where this parameter is NA
-                        na_metrics = metrics_demo[
-                            metrics_demo[f"{opportunity}_t{parameter}"].isna()
-                        ]
-                        # Sum all the demographic keys
-                        na_metrics_sum = (
-                            na_metrics[[i for i in self.config["demographics"].keys()]]
-                            .sum()
-                            .to_frame()
-                            .T
-                        )
-                        # na_metrics_sum.columns = ["unreachable"]
-                        na_metrics_sum["scenario"] = idx
-                        na_metrics_sum["metric"] = f"{opportunity}_t{parameter}"
-                        unreachable_dfs.append(na_metrics_sum)
-        if len(unreachable_dfs) > 0:
+            population = np.nan_to_num(population)
+            for idx, scenario in enumerate(self.config["scenarios"]):
+                metrics = self.read_artifact(f"metrics{idx}.csv")
+                values, has_metrics = self.zone_index.align(
+                    metrics, travel_time_columns, dtype=self.metric_dtype
+                )
+
+                # Sum each group's population in every zone where a metric is NA
+                rows = in_impact_area & has_metrics
+                na_mask = np.isnan(values[rows])
+                unreachable = pd.DataFrame(
+                    na_mask.T.astype("float64") @ population[rows], columns=groups
+                )
+                for group in groups:
+                    if pd.api.types.is_integer_dtype(demographics[group]):
+                        unreachable[group] = unreachable[group].astype("int64")
+                unreachable["scenario"] = idx
+                unreachable["metric"] = travel_time_columns
+                unreachable_dfs.append(unreachable)
             result = pd.concat(unreachable_dfs, axis="index").reset_index(drop=True)
-            result[result.columns[::-1]].to_csv(
-                os.path.join(self.cache_folder, "unreachable.csv"), index=False
+            self.write_artifact(
+                UNREACHABLE_FILENAME, result[result.columns[::-1]], index=False
             )
 
         else:
@@ -463,93 +1376,139 @@ class Analysis:
     def compare_scenarios(self):
         """Compute the differences between all scenarios"""
         self.log.info("Computing scenario comparisons")
-        idxs = [i for i in range(len(self.config["scenarios"]))]
-        compared_dfs = []
-        for pair in combinations(idxs, 2):
-            metrics_a = pd.read_csv(
-                os.path.join(self.cache_folder, f"metrics{pair[0]}.csv"),
-                dtype={"bg_id": str},
-            )
-            metrics_b = pd.read_csv(
-                os.path.join(self.cache_folder, f"metrics{pair[1]}.csv"),
-                dtype={"bg_id": str},
-            )
-            metrics = pd.merge(
-                metrics_a,
-                metrics_b,
-                on="bg_id",
-                suffixes=[f"_{pair[0]}", f"_{pair[1]}"],
+        metric_columns = []
+        for opportunity in self.config["opportunities"]:
+            if self.config["opportunities"][opportunity]["method"] == "cumulative":
+                method = "c"
+            else:
+                method = "t"
+            for parameter in self.config["opportunities"][opportunity]["parameters"]:
+                metric_columns.append(f"{opportunity}_{method}{parameter}")
+
+        # Read each scenario's metrics once, aligned on the zones they all cover
+        metrics = [
+            self.read_artifact(f"metrics{idx}.csv")
+            for idx in range(len(self.config["scenarios"]))
+        ]
+        aligned = [
+            self.zone_index.align(
+                scenario_metrics, metric_columns, dtype=self.metric_dtype
             )
+            for scenario_metrics in metrics
+        ]
+        covered = np.logical_and.reduce([present for _, present in aligned])
+        values = np.stack([scenario_values[covered] for scenario_values, _ in aligned])
+        values = np.nan_to_num(values, nan=self.config["infinity_value"])
+        pairs, differences = scenario_differences(values)
+
+        columns = {"bg_id": self.zone_index.ids[covered]}
+        for idx in range(values.shape[0]):
+            for column, metric in enumerate(metric_columns):
+                columns[f"{metric}_{idx}"] = values[idx, :, column]
+        for pair_idx, pair in enumerate(pairs):
+            for column, metric in enumerate(metric_columns):
+                columns[f"{metric}_{pair[1]}-{pair[0]}"] = differences[
+                    pair_idx, :, column
+                ]
+        compared = pd.DataFrame(columns)
+
+        # Keep whole-number metrics (e.g. job counts) whole
+        for metric in metric_columns:
+            if all(
+                pd.api.types.is_integer_dtype(scenario_metrics[metric])
+                for scenario_metrics in metrics
+            ):
+                integer_columns = [f"{metric}_{idx}" for idx in range(len(metrics))]
+                integer_columns += [f"{metric}_{b}-{a}" for a, b in pairs]
+                compared[integer_columns] = compared[integer_columns].astype("int64")
 
-            metrics = metrics.fillna(self.config["infinity_value"])
-
-            for opportunity in self.config["opportunities"]:
-                if self.config["opportunities"][opportunity]["method"] == "cumulative":
-                    method = "c"
-                else:
-                    method = "t"
-                for parameter in self.config["opportunities"][opportunity][
-                    "parameters"
-                ]:
-                    series_a = metrics[f"{opportunity}_{method}{parameter}_{pair[1]}"]
-                    series_b = metrics[f"{opportunity}_{method}{parameter}_{pair[0]}"]
-                    metrics[
-                        f"{opportunity}_{method}{parameter}_{pair[1]}-{pair[0]}"
-                    ] = (series_a - series_b)
-
-            compared_dfs.append(metrics)
-
-        compared = reduce(lambda df1, df2: pd.merge(df1, df2, on="bg_id"), compared_dfs)
-        compared.to_csv(os.path.join(self.cache_folder, COMPARED_FILENAME), index=False)
+        self.write_artifact(COMPARED_FILENAME, compared, index=False)
         self.log.info("Finished computing scenario comparisons")
 
     def compute_summaries(self):
         """Compute population-weighted summaries for all demographic groups"""
         # Take the compared metrics and summarize all of them
         self.log.info("Computing scenario summaries")
-        compared = pd.read_csv(
-            os.path.join(self.cache_folder, COMPARED_FILENAME),
-            dtype={"bg_id": str},
-            index_col="bg_id",
+        compared = self.read_artifact(COMPARED_FILENAME)
+        demographics = self.read_artifact(DEMOGRAPHICS_FILENAME)
+        impact_area = self.read_artifact(IMPACT_AREA_FILENAME)
+        metric_columns = [c for c in compared.columns if c != "bg_id"]
+        groups = list(self.config["demographics"].keys())
+
+        # Align the scores and demographics to the impact area zones
+        values, _ = self.zone_index.align(
+            compared, metric_columns, dtype=self.metric_dtype
         )
-        demographics = pd.read_csv(
-            os.path.join(self.cache_folder, DEMOGRAPHICS_FILENAME),
-            dtype={"bg_id": str},
-            index_col="bg_id",
-        )
-        impact_area = pd.read_csv(
-            os.path.join(self.cache_folder, IMPACT_AREA_FILENAME),
-            dtype={"bg_id": str},
-            index_col="bg_id",
+        population, has_demographics = self.zone_index.align(
+            demographics, groups, dtype=self.metric_dtype
         )
-
-        # Filter out non-impact area and non-used demographic values
-        compared = compared[compared.index.isin(impact_area.index)]
-        demographics = demographics[demographics.index.isin(impact_area.index)]
+        in_impact_area = self.zone_index.mask(impact_area["bg_id"]) & has_demographics
+        population = population[in_impact_area]
         # Normalize to get fractional amounts
-        demographics = demographics / demographics.sum()
-
-        # Join to get scores
-        weighted = demographics.join(compared)
-
-        weighted_dfs = []
+        population = population / np.nansum(population, axis=0)
 
-        for demographic in self.config["demographics"].keys():
-            mult = weighted[compared.columns].multiply(weighted[demographic], axis=0)
-            mult = mult.sum()
-            weighted_dfs.append(mult)
+        means, quantiles, edges, histograms = weighted_summaries(
+            values[in_impact_area],
+            population,
+            SUMMARY_QUANTILES,
+            SUMMARY_HISTOGRAM_BINS,
+        )
 
-        result = pd.concat(weighted_dfs, axis=1)
-        result.columns = demographics.columns
+        result = pd.DataFrame(means, index=metric_columns, columns=groups)
         result.index.name = "metric"
-        result.to_csv(os.path.join(self.cache_folder, SUMMARY_FILENAME))
+        self.write_artifact(SUMMARY_FILENAME, result)
+
+        metric_idx, group_idx = np.meshgrid(
+            np.arange(len(metric_columns)), np.arange(len(groups)), indexing="ij"
+        )
+        quantile_df = pd.DataFrame(
+            {
+                "metric": np.asarray(metric_columns)[metric_idx.ravel()],
+                "demographic": np.asarray(groups)[group_idx.ravel()],
+            }
+        )
+        for q_idx, q in enumerate(SUMMARY_QUANTILES):
+            quantile_df[f"p{round(q * 100)}"] = quantiles[:, :, q_idx].ravel()
+        self.write_artifact(QUANTILES_FILENAME, quantile_df, index=False)
+
+        metric_idx, bin_idx, group_idx = np.meshgrid(
+            np.arange(len(metric_columns)),
+            np.arange(SUMMARY_HISTOGRAM_BINS),
+            np.arange(len(groups)),
+            indexing="ij",
+        )
+        histogram_df = pd.DataFrame(
+            {
+                "metric": np.asarray(metric_columns)[metric_idx.ravel()],
+                "demographic": np.asarray(groups)[group_idx.ravel()],
+                "bin_start": edges[metric_idx.ravel(), bin_idx.ravel()],
+                "bin_end": edges[metric_idx.ravel(), bin_idx.ravel() + 1],
+                "share": histograms.ravel(),
+            }
+        )
+        self.write_artifact(HISTOGRAMS_FILENAME, histogram_df, index=False)
         self.log.info("Finished computing scenario summaries")
 
-    def download_block_groups(self, state, county):
-        return block_groups(
-            state=state, county=county, year=self.settings["census_year"], cb=False
+    @property
+    def block_group_store(self) -> BlockGroupStore:
+        """The shared store of block group geometries for the census year
+
+        Returns
+        -------
+        BlockGroupStore
+            The store, which only downloads missing states unless the
+            ``census_offline`` setting is on
+        """
+        return BlockGroupStore(
+            os.path.join(CACHE_FOLDER, BLOCK_GROUP_STORE_SUBFOLDER),
+            self.settings["census_year"],
+            download=self.settings.get("census_offline", False) is not True,
+            log=self.log,
         )
 
+    def download_block_groups(self, state, county):
+        return self.block_group_store.by_counties({state: county})
+
     def fetch_block_groups(self, counties_by_state: dict, overwrite=False):
         """Fetch all block groups based on a dictonary of counties by state.
 
@@ -595,35 +1554,19 @@ class Analysis:
         """
         self.log.info("Downloading block group data")
         ids_list = [str(i) for i in ids_list]
-        states = {i[:2]: [] for i in ids_list}
-        for bg in ids_list:
-            states[bg[:2]].append(bg[2:5])
-
-        # Clean up duplicates
-        for key in states.keys():
-            states[key] = list(set(states[key]))
 
-        # Fetch the block groups
-        bg_dfs = []
-        for key in states.keys():
-            bg_df = self.download_block_groups(state=key, county=states[key])
-            bg_dfs.append(bg_df)
-
-        all_bg = pd.concat(bg_dfs, axis="index")
+        # Fetch only the block groups in the list
+        all_bg = self.block_group_store.by_ids(ids_list)
         all_bg = all_bg[["GEOID", "geometry"]]
-        all_bg = all_bg[all_bg.GEOID.isin(ids_list)]
         all_bg = all_bg.rename(columns={"GEOID": "bg_id"})
-        bg_centroid = all_bg.copy()
-        # TODO: Use population-weighted centroids instead
-        # Open the centroids file
-        bg_centroid = gpd.read_file(
+        # Look up only the population-weighted centroids in the list
+        centroid_index = CentroidIndex.open(
             MASTER_POPULATION_WEIGHTED_CENTROIDS_FILE,
-            layer=MASTER_POPULATION_WEIGHTED_CENTROIDS_LAYER,
-            dtype={"bg_id": str},
+            MASTER_POPULATION_WEIGHTED_CENTROIDS_LAYER,
+            os.path.join(CACHE_FOLDER, CENTROID_INDEX_SUBFOLDER),
+            log=self.log,
         )
-        bg_centroid = bg_centroid[bg_centroid.bg_id.isin(ids_list)]
-        # bg_centroid["geometry"] = bg_centroid["geometry"].centroid
-        bg_centroid = bg_centroid.rename(columns={"bg_id": "id"})
+        bg_centroid = centroid_index.lookup(ids_list)
         bg_centroid[["id", "geometry"]].to_file(
             os.path.join(self.cache_folder, CENTROIDS_FILENAME)
         )
@@ -639,144 +1582,48 @@ class Analysis:
             A pandas dataframe containing the demographic data for the impact area.
         """
         # See: https://api.census.gov/data/2021/acs/acs5
-        # Read in the analysis centroids
-        api_key = self.settings["api_key"]
         self.log.info("Downloading demographic data")
-        impact_area_bgs = pd.read_csv(
-            os.path.join(self.cache_folder, IMPACT_AREA_FILENAME), dtype={"bg_id": str}
-        )
+        impact_area_bgs = self.read_artifact(IMPACT_AREA_FILENAME)
         impact_area_bgs["state"] = impact_area_bgs["bg_id"].str[:2]
         impact_area_bgs["county"] = impact_area_bgs["bg_id"].str[2:5]
         states_and_counties = (
             impact_area_bgs[["state", "county"]].drop_duplicates().sort_values("state")
         )
-        all_data = []
-        # First we fetch all the easy ones
-        variables = [i for i in demographic_categories.keys()]
-        print(variables)
-        for idx, area in states_and_counties.iterrows():
-            self.log.debug(
-                f"  Fetching State: {area['state']} County: {area['county']}"
-            )
-            data = get_census(
-                dataset="acs/acs5",
-                year="2021",
-                variables=variables,
-                params={
-                    "for": "block group:*",
-                    "in": f"state:{area['state']} county:{area['county']}",
-                    "key": api_key,
-                },
-                return_geoid=True,
+        self.log.debug(f"  Fetching {states_and_counties.shape[0]} counties")
+        census_cache = None
+        cache_size = self.settings.get("census_cache_size_mb", CENSUS_CACHE_SIZE_MB)
+        if cache_size:
+            census_cache = CensusCache(
+                os.path.join(CACHE_FOLDER, CENSUS_CACHE_SUBFOLDER),
+                int(float(cache_size) * 2**20),
+                offline=self.settings.get("census_offline", False) is True,
+                log=self.log,
             )
-
-            # Income Data
-            income_data = get_census(
-                dataset="acs/acs5",
-                year="2021",
-                variables=income_categories,
-                params={
-                    "for": "block group:*",
-                    "in": f"state:{area['state']} county:{area['county']}",
-                    "key": api_key,
-                },
-                return_geoid=True,
-            )
-
-            # Make sure they're numbers or summing goes very badly
-            income_data[income_categories] = income_data[income_categories].astype(int)
-            income_data["in_poverty"] = income_data[income_categories].sum(
-                axis="columns"
-            )
-            data = pd.merge(data, income_data[["in_poverty", "GEOID"]])
-
-            # Age data
-            age_data = get_census(
-                dataset="acs/acs5",
-                year="2021",
-                variables=age_categories,
-                params={
-                    "for": "block group:*",
-                    "in": f"state:{area['state']} county:{area['county']}",
-                    "key": api_key,
-                },
-                return_geoid=True,
-            )
-
-            # Make sure they're numbers or summing goes very badly
-            age_data[age_categories] = age_data[age_categories].astype(int)
-            age_data["age_65p"] = age_data[age_categories].sum(axis="columns")
-
-            data = pd.merge(data, age_data[["age_65p", "GEOID"]], on="GEOID")
-
-            all_hhld = get_census(
-                dataset="acs/acs5",
-                year="2021",
-                variables=[total_hhld],
-                params={
-                    "for": "block group:*",
-                    "in": f"state:{area['state']} county:{area['county']}",
-                    "key": api_key,
-                },
-                return_geoid=True,
-            )
-            all_hhld["tract_id"] = all_hhld["GEOID"].str[:-1]
-            all_hhld[total_hhld] = all_hhld[total_hhld].astype(int)
-            all_hhld_gb = (
-                all_hhld[["tract_id", total_hhld]]
-                .groupby("tract_id", as_index=False)
-                .sum()
-            )
-            all_hhld = pd.merge(all_hhld, all_hhld_gb, how="left", on="tract_id")
-
-            # Create a proportion table for assignment
-            all_hhld.columns = ["bg_hhld", "bg_id", "tract_id", "tract_hhld"]
-            all_hhld["proportion"] = all_hhld["bg_hhld"] / all_hhld["tract_hhld"]
-            all_hhld = all_hhld[["bg_id", "tract_id", "proportion"]]
-
-            # Zero-car HHLD data
-            zc_hhld = get_census(
-                dataset="acs/acs5",
-                year="2021",
-                variables=[zero_car_hhld],
-                params={
-                    "for": "tract:*",
-                    "in": f"state:{area['state']} county:{area['county']}",
-                    "key": api_key,
-                },
-                return_geoid=True,
-            )
-
-            zc_hhld[zero_car_hhld] = zc_hhld[zero_car_hhld].astype(int)
-            zc_all = pd.merge(
-                all_hhld, zc_hhld, how="left", left_on="tract_id", right_on="GEOID"
-            )
-            zc_all["zero_car_hhld"] = zc_all[zero_car_hhld] * zc_all["proportion"]
-            zc_all["zero_car_hhld"] = (
-                zc_all["zero_car_hhld"].fillna(0).round().astype(int)
+        client = CensusClient(
+            self.settings.get("api_key"),
+            base_url=self.settings.get("census_api_url", CENSUS_API_URL),
+            retries=self.config.get("census_retries", CENSUS_RETRIES),
+            cache=census_cache,
+            log=self.log,
+        )
+        result = fetch_demographics(
+            client,
+            states_and_counties,
+            workers=self.config.get("census_workers", CENSUS_WORKERS),
+        )
+        if census_cache is not None:
+            self.log.info(
+                f"  Census cache: {census_cache.hits} hits, "
+                f"{census_cache.misses} misses"
             )
 
-            # Rename columns back to match the pattern above
-            zc_all = zc_all[["bg_id", "zero_car_hhld"]]
-            zc_all = zc_all.rename(columns={"bg_id": "GEOID"})
-
-            data = pd.merge(data, zc_all[["GEOID", "zero_car_hhld"]], on="GEOID")
-
-            all_data.append(data)
-
-        result = pd.concat(all_data, axis="index")
-
-        # Now let's do the age one
-
         # Rename our GEOID
         result = result.rename(columns={"GEOID": "bg_id"})
         result = result[result["bg_id"].isin(impact_area_bgs["bg_id"])]
         # Move the bg_id column to the front
         bg_column = result.pop("bg_id")
         result.insert(0, "bg_id", bg_column)
-        result.to_csv(
-            os.path.join(self.cache_folder, DEMOGRAPHICS_FILENAME), index=False
-        )
+        self.write_artifact(DEMOGRAPHICS_FILENAME, result, index=False)
         self.log.info("Finished downloading demographic data")
         return result
 
@@ -788,11 +1635,13 @@ class Analysis:
             os.path.join(self.cache_folder, CENTROIDS_FILENAME),
             dtype={"id": str},
         )
+        self._zone_index = ZoneIndex(analysis_area["id"].astype(str))
         impact_area = pd.read_csv(
             os.path.join(self.cache_folder, IMPACT_AREA_FILENAME), dtype={"bg_id": str}
         )
-        # Check to make sure the ID string is long enough to be a block group
-        wrong_length = analysis_area[analysis_area["id"].str.len() != 12]
+        # Check to make sure the IDs are block group GEOIDs, the same check the
+        # zone index uses, so no zone is silently left out of the results
+        wrong_length = analysis_area[encode_geoids(analysis_area["id"]) < 0]
         if wrong_length.shape[0] > 0:
             wrong_length_filename = os.path.join(
                 self.cache_folder,
@@ -803,7 +1652,7 @@ class Analysis:
             self.log.error(
                 f"  There are {wrong_length.shape[0]} rows in the analysis area with invalid zone IDs. See {wrong_length_filename} for a list."
             )
-        wrong_length = impact_area[impact_area["bg_id"].str.len() != 12]
+        wrong_length = impact_area[encode_geoids(impact_area["bg_id"]) < 0]
         if wrong_length.shape[0] > 0:
             wrong_length_filename = os.path.join(
                 self.cache_folder, VALIDATION_SUBFOLDER, "length_error_impact_area.csv"
@@ -813,7 +1662,7 @@ class Analysis:
                 f"  There are {wrong_length.shape[0]} rows in the impact area with invalid zone IDs. See {wrong_length_filename} for a list."
             )
         impact_not_in_analysis = impact_area[
-            ~impact_area["bg_id"].isin(analysis_area["id"])
+            ~self.zone_index.contains(impact_area["bg_id"])
         ]
         if impact_not_in_analysis.shape[0] > 0:
             impact_not_in_analysis_filename = os.path.join(
@@ -837,7 +1686,9 @@ class Analysis:
         impact_area = pd.read_csv(
             os.path.join(self.cache_folder, IMPACT_AREA_FILENAME), dtype={"bg_id": str}
         )
-        no_demographics = impact_area[~impact_area["bg_id"].isin(demographics["bg_id"])]
+        no_demographics = impact_area[
+            ~ZoneIndex(demographics["bg_id"]).contains(impact_area["bg_id"])
+        ]
         if no_demographics.shape[0] > 0:
             invalid_demographics_file = os.path.join(
                 self.cache_folder,
@@ -971,7 +1822,7 @@ class Analysis:
             os.path.join(self.cache_folder, CENTROIDS_FILENAME), dtype={"bg_id": str}
         )
         no_opportunities = analysis_area[
-            ~analysis_area["id"].isin(opportunities["bg_id"])
+            ~ZoneIndex(opportunities["bg_id"]).contains(analysis_area["id"])
         ]
         if no_opportunities.shape[0] > 0:
             no_opportunities_filename = os.path.join(
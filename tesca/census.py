@@ -0,0 +1,288 @@
+"""
+A small client for the Census Data API.
+
+All of the block group variables an analysis needs are requested together, and
+the counties of an impact area are fetched concurrently, retrying requests that
+fail transiently. The client speaks to any server with the Census API's URL
+layout, so it can be pointed at a local fake endpoint.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import time
+from typing import List
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import pandas as pd
+
+from .census_cache import CensusCache
+from .util import (
+    age_categories,
+    demographic_categories,
+    income_categories,
+    total_hhld,
+    zero_car_hhld,
+)
+
+#: Base URL of the Census Data API
+CENSUS_API_URL = "https://api.census.gov/data"
+#: ACS dataset the demographics are fetched from
+CENSUS_DATASET = "acs/acs5"
+#: ACS year the demographics are fetched for
+CENSUS_YEAR = "2021"
+#: Most variables the Census API returns from one request
+MAX_VARIABLES = 50
+#: Default number of concurrent Census requests
+CENSUS_WORKERS = 8
+#: Default number of times a failed Census request is retried
+CENSUS_RETRIES = 3
+#: HTTP status codes of failures worth retrying
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+#: Geography columns making up the GEOID of each summary level, in order
+GEOID_COLUMNS = {
+    "block group": ["state", "county", "tract", "block group"],
+    "tract": ["state", "county", "tract"],
+}
+
+
+class CensusClient:
+    """A client for one dataset and year of the Census Data API
+
+    Parameters
+    ----------
+    api_key : str
+        The Census API key
+    dataset : str, optional
+        The dataset, by default ``acs/acs5``
+    year : str, optional
+        The year of the dataset, by default 2021
+    base_url : str, optional
+        The base URL of the API, by default the Census Data API
+    retries : int, optional
+        The number of times a transiently failing request is retried
+    backoff : float, optional
+        The seconds to wait before the first retry, doubled for every retry
+    timeout : float, optional
+        The seconds to wait for a response
+    cache : CensusCache, optional
+        The cache to serve responses from, if any
+    log : logging.Logger, optional
+        The logger to report requests to
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        dataset: str = CENSUS_DATASET,
+        year: str = CENSUS_YEAR,
+        base_url: str = CENSUS_API_URL,
+        retries: int = CENSUS_RETRIES,
+        backoff: float = 1.0,
+        timeout: float = 60.0,
+        cache: CensusCache = None,
+        log: logging.Logger = None,
+    ):
+        self.api_key = api_key
+        self.dataset = dataset
+        self.year = str(year)
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.log = log if log is not None else logging.getLogger(__name__)
+
+    def request(self, params: dict) -> List[list]:
+        """Make one API request, from the cache if possible
+
+        Parameters
+        ----------
+        params : dict
+            The query parameters, without the API key
+
+        Returns
+        -------
+        List[list]
+            The rows of the response, the first of which is the header
+        """
+        if self.cache is None:
+            return self._download(params)
+
+        key = CensusCache.key(self.dataset, self.year, params)
+        rows = self.cache.get(key)
+        if rows is None:
+            if self.cache.offline:
+                raise RuntimeError(
+                    f"Census request for {params['for']} in {params['in']} "
+                    "is not cached and the Census cache is offline"
+                )
+            rows = self._download(params)
+            self.cache.put(key, rows)
+        return rows
+
+    def _download(self, params: dict) -> List[list]:
+        """Make one API request, retrying transient failures"""
+        query = dict(params)
+        if self.api_key is not None:
+            query["key"] = self.api_key
+        url = (
+            f"{self.base_url}/{self.year}/{self.dataset}?"
+            f"{urllib.parse.urlencode(query)}"
+        )
+        for attempt in range(self.retries + 1):
+            try:
+                with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                    return json.load(response)
+            except urllib.error.HTTPError as e:
+                if e.code not in RETRY_STATUS_CODES or attempt == self.retries:
+                    raise RuntimeError(
+                        f"Census request for {params['for']} in {params['in']} "
+                        f"failed with status {e.code}"
+                    ) from e
+                error = e
+            except (urllib.error.URLError, TimeoutError) as e:
+                if attempt == self.retries:
+                    raise RuntimeError(
+                        f"Census request for {params['for']} in {params['in']} "
+                        f"failed: {e}"
+                    ) from e
+                error = e
+            self.log.debug(f"  Retrying Census request after error: {error}")
+            time.sleep(self.backoff * 2**attempt)
+
+    def fetch(self, variables: List[str], level: str, within: str) -> pd.DataFrame:
+        """Fetch variables for every zone of a summary level in an area
+
+        Parameters
+        ----------
+        variables : List[str]
+            The variables to fetch, split across as few requests as possible
+        level : str
+            The summary level, ``block group`` or ``tract``
+        within : str
+            The enclosing area, e.g. ``state:42 county:003``
+
+        Returns
+        -------
+        pd.DataFrame
+            A ``GEOID`` column and an integer column per variable, with missing
+            estimates as 0
+        """
+        result = None
+        for start in range(0, len(variables), MAX_VARIABLES):
+            rows = self.request(
+                {
+                    "get": ",".join(variables[start : start + MAX_VARIABLES]),
+                    "for": f"{level}:*",
+                    "in": within,
+                }
+            )
+            table = pd.DataFrame(rows[1:], columns=rows[0], dtype=str)
+            table.insert(0, "GEOID", table[GEOID_COLUMNS[level]].agg("".join, axis=1))
+            table = table.drop(columns=GEOID_COLUMNS[level])
+            if result is None:
+                result = table
+            else:
+                result = pd.merge(result, table, on="GEOID")
+        columns = result.columns[1:]
+        result[columns] = (
+            result[columns].apply(pd.to_numeric, errors="coerce").fillna(0)
+        ).astype("int64")
+        return result
+
+
+def apportion_zero_car_households(
+    households: pd.DataFrame, zero_car: pd.DataFrame
+) -> pd.Series:
+    """Split tract zero-car household counts among their block groups
+
+    Each block group gets its share of its tract's zero-car households in
+    proportion to its share of the tract's households.
+
+    Parameters
+    ----------
+    households : pd.DataFrame
+        The ``GEOID`` and total household count of every block group
+    zero_car : pd.DataFrame
+        The ``GEOID`` and zero-car household count of every tract
+
+    Returns
+    -------
+    pd.Series
+        The zero-car households of each block group, rounded, in the order of
+        ``households``
+    """
+    tract_ids = households["GEOID"].str[:-1]
+    bg_hhld = households[total_hhld].to_numpy(dtype="float64")
+    tract_hhld = households[total_hhld].groupby(tract_ids).transform("sum")
+    tract_zero_car = tract_ids.map(zero_car.set_index("GEOID")[zero_car_hhld])
+    result = (
+        tract_zero_car.to_numpy(dtype="float64")
+        * bg_hhld
+        / tract_hhld.to_numpy(dtype="float64")
+    )
+    return pd.Series(result, index=households.index).fillna(0).round().astype(int)
+
+
+def fetch_demographics(
+    client: CensusClient, counties: pd.DataFrame, workers: int = CENSUS_WORKERS
+) -> pd.DataFrame:
+    """Fetch the demographics of every block group in a list of counties
+
+    Parameters
+    ----------
+    client : CensusClient
+        The client to fetch with
+    counties : pd.DataFrame
+        The ``state`` and ``county`` FIPS codes of the counties
+    workers : int, optional
+        The number of concurrent requests
+
+    Returns
+    -------
+    pd.DataFrame
+        The ``GEOID`` of every block group, a column per demographic and income
+        variable, and the derived ``in_poverty``, ``age_65p`` and
+        ``zero_car_hhld`` counts
+    """
+    variables = list(
+        dict.fromkeys(
+            list(demographic_categories.keys())
+            + income_categories
+            + age_categories
+            + [total_hhld]
+        )
+    )
+    areas = [
+        f"state:{state} county:{county}"
+        for state, county in counties[["state", "county"]].itertuples(index=False)
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        block_group_futures = [
+            executor.submit(client.fetch, variables, "block group", area)
+            for area in areas
+        ]
+        tract_futures = [
+            executor.submit(client.fetch, [zero_car_hhld], "tract", area)
+            for area in areas
+        ]
+        block_groups = pd.concat(
+            [future.result() for future in block_group_futures], ignore_index=True
+        )
+        tracts = pd.concat(
+            [future.result() for future in tract_futures], ignore_index=True
+        )
+
+    block_groups["in_poverty"] = block_groups[income_categories].sum(axis="columns")
+    block_groups["age_65p"] = block_groups[age_categories].sum(axis="columns")
+    block_groups["zero_car_hhld"] = apportion_zero_car_households(block_groups, tracts)
+    columns = (
+        ["GEOID"]
+        + list(demographic_categories.keys())
+        + income_categories
+        + ["in_poverty", "age_65p", "zero_car_hhld"]
+    )
+    return block_groups[list(dict.fromkeys(columns))]
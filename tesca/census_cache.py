@@ -0,0 +1,159 @@
+"""
+A persistent cache of Census API responses, shared across analyses.
+
+ACS releases never change once published, so each response is stored under a
+hash of its dataset, year, variables and geography and served from disk the
+next time any analysis asks for it. The cache is kept under a maximum size by
+evicting the least recently used responses, and can be used offline, in which
+case a request that is not cached is an error instead of a download.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import List
+
+#: File extension of cached responses
+RESPONSE_EXTENSION = ".json"
+
+
+class CensusCache:
+    """An on-disk, size-bounded cache of Census API responses
+
+    Parameters
+    ----------
+    folder : str
+        The folder to store responses in
+    max_size : int
+        The maximum total size of the cache, in bytes
+    offline : bool, optional
+        Whether to only serve cached responses, by default False
+    log : logging.Logger, optional
+        The logger to report cache activity to
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        max_size: int,
+        offline: bool = False,
+        log: logging.Logger = None,
+    ):
+        self.folder = folder
+        self.max_size = max_size
+        self.offline = offline
+        self.log = log if log is not None else logging.getLogger(__name__)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+    @staticmethod
+    def key(dataset: str, year: str, params: dict) -> str:
+        """Compute the cache key of a request
+
+        Parameters
+        ----------
+        dataset : str
+            The dataset, e.g. ``acs/acs5``
+        year : str
+            The year of the dataset
+        params : dict
+            The query parameters (variables and geography), without the API key
+
+        Returns
+        -------
+        str
+            A hash of the dataset, year and query
+        """
+        request = {"dataset": dataset, "year": str(year), "params": params}
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}{RESPONSE_EXTENSION}")
+
+    def get(self, key: str) -> List[list]:
+        """Fetch a response from the cache
+
+        Parameters
+        ----------
+        key : str
+            The cache key of the request
+
+        Returns
+        -------
+        List[list]
+            The rows of the response, or None on a miss
+        """
+        path = self._path(key)
+        try:
+            with open(path) as infile:
+                rows = json.load(infile)
+        except (FileNotFoundError, json.JSONDecodeError):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            # Mark the response as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return rows
+
+    def put(self, key: str, rows: List[list]):
+        """Store a response in the cache and evict old responses
+
+        Parameters
+        ----------
+        key : str
+            The cache key of the request
+        rows : List[list]
+            The rows of the response
+        """
+        path = self._path(key)
+        # Write to a temporary file first so readers never see a partial response
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w") as outfile:
+            json.dump(rows, outfile)
+        os.replace(temporary_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep: str = None):
+        """Remove the least recently used responses until the cache fits its size
+
+        Parameters
+        ----------
+        keep : str, optional
+            A response path to never evict, such as the one just written
+        """
+        entries = []
+        for filename in os.listdir(self.folder):
+            if not filename.endswith(RESPONSE_EXTENSION):
+                continue
+            path = os.path.join(self.folder, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Evicted by another thread
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            self.log.debug(
+                f"  Evicting cached Census response {os.path.basename(path)}"
+            )
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
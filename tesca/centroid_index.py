@@ -0,0 +1,173 @@
+"""
+An indexed lookup of population-weighted block group centroids.
+
+The national centroids layer is converted once into two memory-mapped arrays:
+the integer GEOIDs of every centroid, sorted, and their coordinates in the same
+order. Looking up a list of block groups is then a binary search over the
+GEOIDs and a gather of the matching coordinates, which only reads the pages
+holding them instead of the whole layer. The arrays are rebuilt whenever the
+source layer changes.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import List
+
+os.environ["USE_PYGEOS"] = "0"
+
+import geopandas as gpd
+import numpy as np
+
+from .zones import decode_geoids, encode_geoids
+
+#: Filename of the sorted integer GEOIDs
+CODES_FILENAME = "codes.npy"
+#: Filename of the x and y coordinates, in GEOID order
+COORDINATES_FILENAME = "coordinates.npy"
+#: Filename of the index's source file signature and coordinate reference system
+METADATA_FILENAME = "metadata.json"
+
+
+class CentroidIndex:
+    """Population-weighted centroids, indexed by integer GEOID
+
+    Use :meth:`open` to build the index from a centroids layer if needed.
+
+    Parameters
+    ----------
+    folder : str
+        The folder holding the index arrays
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.codes = np.load(os.path.join(folder, CODES_FILENAME), mmap_mode="r")
+        self.coordinates = np.load(
+            os.path.join(folder, COORDINATES_FILENAME), mmap_mode="r"
+        )
+        with open(os.path.join(folder, METADATA_FILENAME)) as infile:
+            self.crs = json.load(infile)["crs"]
+
+    @staticmethod
+    def _signature(source_file: str, layer: str) -> dict:
+        stat = os.stat(source_file)
+        return {"layer": layer, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    @classmethod
+    def build(
+        cls,
+        source_file: str,
+        layer: str,
+        folder: str,
+        id_column: str = "bg_id",
+        log: logging.Logger = None,
+    ):
+        """Build the index arrays from a centroids layer
+
+        Parameters
+        ----------
+        source_file : str
+            The file of the centroids layer
+        layer : str
+            The name of the layer
+        folder : str
+            The folder to write the index arrays to
+        id_column : str, optional
+            The column of GEOIDs, by default ``bg_id``
+        log : logging.Logger, optional
+            The logger to report to
+        """
+        log = log if log is not None else logging.getLogger(__name__)
+        log.debug(f"  Indexing centroids in {source_file}")
+        centroids = gpd.read_file(source_file, layer=layer)
+        codes = encode_geoids(centroids[id_column].astype(str))
+        order = np.argsort(codes, kind="stable")
+        valid = codes[order] >= 0
+        coordinates = np.column_stack(
+            [centroids.geometry.x.to_numpy(), centroids.geometry.y.to_numpy()]
+        )
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        # Write to temporary files first so readers never see a partial index,
+        # and the metadata last so the index only counts once it is complete
+        suffix = f"{os.getpid()}.{threading.get_ident()}.tmp"
+        for filename, values in [
+            (CODES_FILENAME, codes[order][valid]),
+            (COORDINATES_FILENAME, coordinates[order][valid]),
+        ]:
+            path = os.path.join(folder, filename)
+            with open(f"{path}.{suffix}", "wb") as outfile:
+                np.save(outfile, values)
+            os.replace(f"{path}.{suffix}", path)
+        metadata = cls._signature(source_file, layer)
+        metadata["crs"] = centroids.crs.to_wkt() if centroids.crs else None
+        path = os.path.join(folder, METADATA_FILENAME)
+        with open(f"{path}.{suffix}", "w") as outfile:
+            json.dump(metadata, outfile)
+        os.replace(f"{path}.{suffix}", path)
+
+    @classmethod
+    def open(
+        cls, source_file: str, layer: str, folder: str, log: logging.Logger = None
+    ):
+        """Open the index of a centroids layer, building it if it is out of date
+
+        Parameters
+        ----------
+        source_file : str
+            The file of the centroids layer
+        layer : str
+            The name of the layer
+        folder : str
+            The folder of the index arrays
+        log : logging.Logger, optional
+            The logger to report to
+
+        Returns
+        -------
+        CentroidIndex
+            The index
+        """
+        metadata_file = os.path.join(folder, METADATA_FILENAME)
+        current = False
+        if os.path.exists(metadata_file):
+            with open(metadata_file) as infile:
+                metadata = json.load(infile)
+            signature = cls._signature(source_file, layer)
+            current = all(metadata.get(k) == v for k, v in signature.items())
+        if not current:
+            cls.build(source_file, layer, folder, log=log)
+        return cls(folder)
+
+    def lookup(self, ids: List[str]) -> gpd.GeoDataFrame:
+        """Look up the centroids of a list of block groups
+
+        Parameters
+        ----------
+        ids : List[str]
+            The 12-digit block group GEOIDs
+
+        Returns
+        -------
+        gpd.GeoDataFrame
+            An ``id`` column and point geometry for every block group found,
+            ordered by GEOID
+        """
+        codes = np.unique(encode_geoids(ids))
+        codes = codes[codes >= 0]
+        if len(self.codes) == 0:
+            positions = np.zeros(0, dtype=np.int64)
+        else:
+            positions = np.minimum(
+                np.searchsorted(self.codes, codes), len(self.codes) - 1
+            )
+            positions = positions[self.codes[positions] == codes]
+        coordinates = self.coordinates[positions]
+        return gpd.GeoDataFrame(
+            {"id": decode_geoids(self.codes[positions])},
+            geometry=gpd.points_from_xy(coordinates[:, 0], coordinates[:, 1]),
+            crs=self.crs,
+        )
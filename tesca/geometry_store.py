@@ -0,0 +1,163 @@
+"""
+A local store of block group geometries, shared across analyses.
+
+Block groups are downloaded from the Census TIGER files once per state and
+census year, and stored as a GeoParquet file per state, sorted by GEOID in
+small row groups. The row group statistics act as an index on GEOID, so looking
+up a list of block groups or the block groups of a few counties only reads the
+row groups holding them. A server can be seeded ahead of time, see
+``seed_block_groups.py``, and then works without downloading anything.
+"""
+
+import logging
+import os
+import threading
+from typing import Dict, List
+
+os.environ["USE_PYGEOS"] = "0"
+
+import geopandas as gpd
+import pandas as pd
+from pygris import block_groups
+
+#: Block groups per row group of a state's file
+ROW_GROUP_SIZE = 1000
+#: File extension of stored states
+STATE_EXTENSION = ".parquet"
+
+
+class BlockGroupStore:
+    """Block group geometries of one census year, partitioned by state
+
+    Parameters
+    ----------
+    folder : str
+        The folder holding the stores of every census year
+    year : int
+        The census year of the block groups
+    download : bool, optional
+        Whether to download states that have not been stored yet, by default
+        True. Without downloads, looking up a missing state is an error.
+    log : logging.Logger, optional
+        The logger to report store activity to
+    """
+
+    def __init__(
+        self, folder: str, year: int, download: bool = True, log: logging.Logger = None
+    ):
+        self.folder = os.path.join(folder, str(year))
+        self.year = year
+        self.download = download
+        self.log = log if log is not None else logging.getLogger(__name__)
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+    def _path(self, state: str) -> str:
+        return os.path.join(self.folder, f"{state}{STATE_EXTENSION}")
+
+    def states(self) -> List[str]:
+        """List the states in the store
+
+        Returns
+        -------
+        List[str]
+            The FIPS codes of the stored states
+        """
+        return sorted(
+            filename[: -len(STATE_EXTENSION)]
+            for filename in os.listdir(self.folder)
+            if filename.endswith(STATE_EXTENSION)
+        )
+
+    def seed(self, state: str, overwrite: bool = False):
+        """Download a state's block groups into the store
+
+        Parameters
+        ----------
+        state : str
+            The FIPS code of the state
+        overwrite : bool, optional
+            Whether to download the state again if it is already stored, by
+            default False
+        """
+        path = self._path(state)
+        if os.path.exists(path) and overwrite is False:
+            return
+        self.log.debug(f"  Downloading {self.year} block groups of state {state}")
+        bgs = block_groups(state=state, year=self.year, cb=False)
+        bgs = bgs.sort_values("GEOID").reset_index(drop=True)
+        # Write to a temporary file first so readers never see a partial state
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        bgs.to_parquet(temporary_path, index=False, row_group_size=ROW_GROUP_SIZE)
+        os.replace(temporary_path, path)
+
+    def _read(self, state: str, filters: list) -> gpd.GeoDataFrame:
+        """Read the block groups of a state matching a pyarrow filter"""
+        if not os.path.exists(self._path(state)):
+            if self.download is False:
+                raise KeyError(f"State {state} is not in the block group store")
+            self.seed(state)
+        return gpd.read_parquet(self._path(state), filters=filters)
+
+    def by_ids(self, ids: List[str]) -> gpd.GeoDataFrame:
+        """Look up block groups by GEOID
+
+        Parameters
+        ----------
+        ids : List[str]
+            The 12-digit block group GEOIDs
+
+        Returns
+        -------
+        gpd.GeoDataFrame
+            The TIGER attributes and geometry of the block groups found, ordered
+            by GEOID
+        """
+        ids = sorted(set(str(i) for i in ids))
+        ids_by_state = {}
+        for bg_id in ids:
+            ids_by_state.setdefault(bg_id[:2], []).append(bg_id)
+        return self._concat(
+            self._read(state, [("GEOID", "in", state_ids)])
+            for state, state_ids in ids_by_state.items()
+        )
+
+    def by_counties(self, counties_by_state: Dict[str, List[str]]) -> gpd.GeoDataFrame:
+        """Look up the block groups of a list of counties
+
+        Parameters
+        ----------
+        counties_by_state : Dict[str, List[str]]
+            The 3-digit county FIPS codes, keyed by 2-digit state FIPS code
+
+        Returns
+        -------
+        gpd.GeoDataFrame
+            The TIGER attributes and geometry of the block groups, ordered by GEOID
+        """
+        frames = []
+        for state, counties in counties_by_state.items():
+            state = str(state)
+            if isinstance(counties, str):
+                counties = [counties]
+            # A county's GEOIDs sort between its prefix and the prefix followed
+            # by a letter, since GEOIDs are all digits
+            filters = [
+                [
+                    ("GEOID", ">=", f"{state}{county}"),
+                    ("GEOID", "<", f"{state}{county}A"),
+                ]
+                for county in sorted(set(counties))
+            ]
+            frames.append(self._read(state, filters))
+        return self._concat(frames)
+
+    @staticmethod
+    def _concat(frames) -> gpd.GeoDataFrame:
+        """Combine the block groups of several states"""
+        frames = list(frames)
+        if len(frames) == 0:
+            return gpd.GeoDataFrame({"GEOID": []}, geometry=[])
+        return gpd.GeoDataFrame(
+            pd.concat(frames, axis="index", ignore_index=True), crs=frames[0].crs
+        )
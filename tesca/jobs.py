@@ -0,0 +1,67 @@
+"""
+LODES job counts, indexed by block group.
+
+The national jobs file is parsed once into a zone index of its block groups and
+an array of their counts, so finding the jobs of any set of block groups is a
+binary search and a gather rather than a parse and a merge.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .zones import ZoneIndex
+
+#: Column of the LODES total job count
+JOBS_COLUMN = "C000"
+
+
+class JobsTable:
+    """Job counts of block groups
+
+    Parameters
+    ----------
+    ids : array-like
+        The block group GEOIDs
+    counts : array-like
+        The job count of each block group
+    """
+
+    def __init__(self, ids, counts):
+        self.index = ZoneIndex(ids)
+        self.counts = np.asarray(counts, dtype=np.int64)
+
+    @classmethod
+    def from_csv(cls, path: str):
+        """Read a jobs file
+
+        Parameters
+        ----------
+        path : str
+            The path of a CSV file, optionally compressed, with ``bg_id`` and
+            ``C000`` columns
+
+        Returns
+        -------
+        JobsTable
+            The jobs of every block group in the file
+        """
+        jobs = pd.read_csv(
+            path, usecols=["bg_id", JOBS_COLUMN], dtype={"bg_id": str, JOBS_COLUMN: int}
+        )
+        return cls(jobs["bg_id"], jobs[JOBS_COLUMN])
+
+    def lookup(self, ids) -> np.ndarray:
+        """Find the job counts of block groups
+
+        Parameters
+        ----------
+        ids : array-like
+            The block group GEOIDs
+
+        Returns
+        -------
+        np.ndarray
+            The job count of each block group, 0 for block groups without jobs
+        """
+        positions = self.index.positions(ids)
+        return np.where(positions >= 0, self.counts[positions], 0)
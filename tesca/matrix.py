@@ -0,0 +1,258 @@
+"""
+Compact binary storage for travel time matrices.
+
+Matrices are stored as dense origin by destination NumPy ``.npy`` arrays rather
+than CSV, so they can be memory-mapped: several processes can share one matrix
+without copying it, and the travel times from any origin are a single row. Rows
+and columns follow a zone index shared by all of a project's matrices, which is
+stored once as a list of zone IDs flagging the zones routed from (the matrix
+rows) and to (the matrix columns). Travel times are whole minutes in the
+smallest unsigned integer type that fits them, with the largest value of that
+type marking pairs that cannot be reached. CSV is only produced on demand, for
+downloads.
+"""
+
+import numpy as np
+import pandas as pd
+
+#: Number of origins formatted at a time when exporting to CSV
+CSV_CHUNK_SIZE = 1_000
+
+
+def unreachable_value(dtype) -> int:
+    """The value marking unreachable pairs in a matrix of the given type.
+
+    Parameters
+    ----------
+    dtype : np.dtype
+        The unsigned integer type of the matrix
+
+    Returns
+    -------
+    int
+        The largest value of the type
+    """
+    return np.iinfo(dtype).max
+
+
+def write_zones(zones, path: str, origins=None, destinations=None):
+    """Write a zone index to a CSV file.
+
+    Parameters
+    ----------
+    zones : array-like
+        The zone IDs
+    path : str
+        The path of the CSV file to write
+    origins : array-like, optional
+        The zone IDs of the matrix rows, by default all zones
+    destinations : array-like, optional
+        The zone IDs of the matrix columns, by default all zones
+    """
+    zones = pd.Series(np.asarray(zones, dtype=str), name="bg_id")
+    pd.DataFrame(
+        {
+            "bg_id": zones,
+            "origin": True if origins is None else zones.isin(origins),
+            "destination": True if destinations is None else zones.isin(destinations),
+        }
+    ).to_csv(path, index=False)
+
+
+def read_matrix_zones(path: str):
+    """Read the matrix row and column zones of a zone index CSV file.
+
+    Parameters
+    ----------
+    path : str
+        The path of the zone index CSV file
+
+    Returns
+    -------
+    tuple
+        The zone IDs of the matrix rows (origins) and columns (destinations)
+    """
+    zones = pd.read_csv(path, dtype={"bg_id": str})
+    origins = zones["bg_id"]
+    destinations = zones["bg_id"]
+    # Indexes without flags route between all zones
+    if "origin" in zones.columns:
+        origins = origins[zones["origin"].astype(bool)]
+    if "destination" in zones.columns:
+        destinations = destinations[zones["destination"].astype(bool)]
+    return origins.to_numpy(dtype=str), destinations.to_numpy(dtype=str)
+
+
+def _matrix_cells(matrix: pd.DataFrame, origins, destinations):
+    """Find the dense cells and type of the reachable pairs of a long matrix"""
+    origin_index = pd.Index(np.asarray(origins, dtype=str))
+    destination_index = pd.Index(np.asarray(destinations, dtype=str))
+    from_idx = origin_index.get_indexer(matrix["from_id"].astype(str))
+    to_idx = destination_index.get_indexer(matrix["to_id"].astype(str))
+    if (from_idx < 0).any() or (to_idx < 0).any():
+        raise KeyError("The matrix contains zones that are not in the zone index")
+
+    travel_time = matrix["travel_time"].to_numpy(dtype="float64", na_value=np.nan)
+    reachable = ~np.isnan(travel_time)
+    # Use a single byte per pair when every travel time fits in one
+    dtype = np.uint8
+    if reachable.any() and travel_time[reachable].max() >= unreachable_value(dtype):
+        dtype = np.uint16
+    return from_idx[reachable], to_idx[reachable], travel_time[reachable], dtype
+
+
+def dense_matrix(matrix: pd.DataFrame, origins, destinations) -> np.ndarray:
+    """Convert a long-format travel time matrix to a dense array in memory.
+
+    Parameters
+    ----------
+    matrix : pd.DataFrame
+        A dataframe with ``from_id``, ``to_id`` and ``travel_time`` columns, as
+        produced by r5py
+    origins : array-like
+        The zone IDs giving the matrix row order
+    destinations : array-like
+        The zone IDs giving the matrix column order
+
+    Returns
+    -------
+    np.ndarray
+        The origin by destination travel times, as stored by :func:`write_matrix`
+
+    Raises
+    ------
+    KeyError
+        Raised when the matrix contains zones that are not in the zone index
+    """
+    rows, columns, travel_time, dtype = _matrix_cells(matrix, origins, destinations)
+    unreachable = unreachable_value(dtype)
+    dense = np.full((len(origins), len(destinations)), unreachable, dtype=dtype)
+    dense[rows, columns] = np.clip(travel_time, 0, unreachable - 1)
+    return dense
+
+
+def write_matrix(matrix: pd.DataFrame, path: str, origins, destinations):
+    """Write a long-format travel time matrix to a dense ``.npy`` file.
+
+    Parameters
+    ----------
+    matrix : pd.DataFrame
+        A dataframe with ``from_id``, ``to_id`` and ``travel_time`` columns, as
+        produced by r5py
+    path : str
+        The path of the ``.npy`` file to write
+    origins : array-like
+        The zone IDs giving the matrix row order
+    destinations : array-like
+        The zone IDs giving the matrix column order
+
+    Raises
+    ------
+    KeyError
+        Raised when the matrix contains zones that are not in the zone index
+    """
+    rows, columns, travel_time, dtype = _matrix_cells(matrix, origins, destinations)
+    unreachable = unreachable_value(dtype)
+
+    dense = np.lib.format.open_memmap(
+        path,
+        mode="w+",
+        dtype=dtype,
+        shape=(len(origins), len(destinations)),
+    )
+    dense[:] = unreachable
+    dense[rows, columns] = np.clip(travel_time, 0, unreachable - 1)
+    dense.flush()
+    del dense
+
+
+def open_matrix(path: str) -> np.ndarray:
+    """Open a dense matrix file as a read-only memory map.
+
+    Parameters
+    ----------
+    path : str
+        The path of the ``.npy`` matrix file
+
+    Returns
+    -------
+    np.ndarray
+        The memory-mapped origin by destination travel times
+    """
+    return np.load(path, mmap_mode="r")
+
+
+def _to_long(dense: np.ndarray, origins: np.ndarray, destinations: np.ndarray):
+    """Convert dense rows of a matrix to a long-format dataframe"""
+    travel_time = pd.array(dense.ravel(), dtype=f"UInt{dense.dtype.itemsize * 8}")
+    travel_time[travel_time == unreachable_value(dense.dtype)] = pd.NA
+    return pd.DataFrame(
+        {
+            "from_id": np.repeat(origins, len(destinations)),
+            "to_id": np.tile(destinations, len(origins)),
+            "travel_time": travel_time,
+        }
+    )
+
+
+def iter_matrix_csv(path: str, origins, destinations, chunk_size: int = CSV_CHUNK_SIZE):
+    """Generate the CSV text of a matrix file a chunk of origins at a time.
+
+    Parameters
+    ----------
+    path : str
+        The path of the ``.npy`` matrix file
+    origins : array-like
+        The zone IDs giving the matrix row order
+    destinations : array-like
+        The zone IDs giving the matrix column order
+    chunk_size : int, optional
+        The number of origins to format at a time, by default ``CSV_CHUNK_SIZE``
+
+    Yields
+    ------
+    str
+        CSV text, starting with the header row. Unreachable pairs have an empty
+        travel time.
+    """
+    origins = np.asarray(origins, dtype=object)
+    destinations = np.asarray(destinations, dtype=object)
+    dense = open_matrix(path)
+    yield "from_id,to_id,travel_time\n"
+    for start in range(0, dense.shape[0], chunk_size):
+        end = start + chunk_size
+        chunk = _to_long(dense[start:end], origins[start:end], destinations)
+        yield chunk.to_csv(index=False, header=False)
+
+
+def combine_matrices(paths, path: str):
+    """Stack the rows of several dense matrix files into one matrix file.
+
+    The combined matrix uses the widest type of the parts, so a part stored as
+    8-bit integers is widened (including its unreachable marker) if another part
+    needed 16 bits.
+
+    Parameters
+    ----------
+    paths : List[str]
+        The paths of the ``.npy`` matrix files to stack, in row order. They must
+        all have the same destinations.
+    path : str
+        The path of the combined ``.npy`` matrix file to write
+    """
+    parts = [open_matrix(p) for p in paths]
+    dtype = np.result_type(*[part.dtype for part in parts])
+    combined = np.lib.format.open_memmap(
+        path,
+        mode="w+",
+        dtype=dtype,
+        shape=(sum(part.shape[0] for part in parts), parts[0].shape[1]),
+    )
+    row = 0
+    for part in parts:
+        block = np.asarray(part).astype(dtype)
+        block[part == unreachable_value(part.dtype)] = unreachable_value(dtype)
+        combined[row : row + part.shape[0]] = block
+        row += part.shape[0]
+    combined.flush()
+    del combined
@@ -0,0 +1,144 @@
+"""
+A per-project cache of computed metric columns.
+
+Each metric column is keyed by the hash of the travel time matrix it was
+computed from, the hash of the opportunity counts, and the measure's method and
+parameter, so adding a parameter to an opportunity only computes the new column.
+Columns the configuration no longer asks for are evicted.
+"""
+
+import hashlib
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+#: File extension of cached metric columns
+COLUMN_EXTENSION = ".npy"
+
+
+def column_hash(opportunity_df: pd.DataFrame, name: str) -> str:
+    """Hash the counts of an opportunity
+
+    Parameters
+    ----------
+    opportunity_df : pd.DataFrame
+        The opportunities, with a ``bg_id`` column and a column per opportunity
+    name : str
+        The name of the opportunity
+
+    Returns
+    -------
+    str
+        A hash of the zone IDs, counts and type of the opportunity column
+    """
+    digest = hashlib.sha256(str(opportunity_df[name].dtype).encode())
+    digest.update(
+        pd.util.hash_pandas_object(opportunity_df[["bg_id", name]], index=False)
+        .to_numpy()
+        .tobytes()
+    )
+    return digest.hexdigest()
+
+
+class MetricCache:
+    """An on-disk cache of metric columns
+
+    Parameters
+    ----------
+    folder : str
+        The folder to store metric columns in
+    log : logging.Logger, optional
+        The logger to report cache activity to
+    """
+
+    def __init__(self, folder: str, log: logging.Logger = None):
+        self.folder = folder
+        self.log = log if log is not None else logging.getLogger(__name__)
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+    @staticmethod
+    def key(
+        matrix_hash: str,
+        column_hash: str,
+        method: str,
+        parameter: int,
+        dtype: str = "float64",
+    ) -> str:
+        """Compute the cache key of a metric column
+
+        Parameters
+        ----------
+        matrix_hash : str
+            The hash of the travel time matrix and its zone index
+        column_hash : str
+            The hash of the opportunity counts, see :func:`column_hash`
+        method : str
+            The measure, ``cumulative`` or ``travel_time``
+        parameter : int
+            The threshold or n of the measure
+        dtype : str, optional
+            The floating point type the column was computed in, by default
+            ``float64``
+
+        Returns
+        -------
+        str
+            A hash of all of the above
+        """
+        return hashlib.sha256(
+            f"{matrix_hash}:{column_hash}:{method}:{parameter}:{dtype}".encode()
+        ).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}{COLUMN_EXTENSION}")
+
+    def get(self, key: str) -> np.ndarray:
+        """Fetch a metric column from the cache
+
+        Parameters
+        ----------
+        key : str
+            The cache key of the column
+
+        Returns
+        -------
+        np.ndarray
+            The column values, in matrix row order, or None on a miss
+        """
+        if not os.path.exists(self._path(key)):
+            return None
+        return np.load(self._path(key))
+
+    def put(self, key: str, values: np.ndarray):
+        """Store a metric column in the cache
+
+        Parameters
+        ----------
+        key : str
+            The cache key of the column
+        values : np.ndarray
+            The column values, in matrix row order
+        """
+        # Write to a temporary file first so readers never see a partial column
+        temporary_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as outfile:
+            np.save(outfile, values)
+        os.replace(temporary_path, self._path(key))
+
+    def evict(self, keep: set):
+        """Remove every cached column that is no longer used
+
+        Parameters
+        ----------
+        keep : set
+            The cache keys of the columns still in use
+        """
+        for filename in os.listdir(self.folder):
+            if not filename.endswith(COLUMN_EXTENSION):
+                continue
+            if filename[: -len(COLUMN_EXTENSION)] not in keep:
+                self.log.debug(f"  Evicting cached metric {filename}")
+                os.remove(os.path.join(self.folder, filename))
@@ -0,0 +1,625 @@
+"""
+Vectorized access to opportunity kernels.
+
+These functions work directly on dense origin by destination travel time
+matrices (see :mod:`tesca.matrix`) and on opportunity counts aligned to the
+destination zones, computing every measure of a kind in one pass over the
+matrix instead of one pass per opportunity and parameter. :class:`MetricsEngine`
+puts them together behind a zone-indexed interface.
+"""
+
+from itertools import combinations
+import os
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from .matrix import open_matrix, read_matrix_zones, unreachable_value
+from .zones import ZoneIndex
+
+#: Number of origins processed at a time, bounding the working memory
+ORIGIN_CHUNK_SIZE = 500
+
+
+def opportunity_matrix(
+    opportunity_df: pd.DataFrame, zones, columns: List[str]
+) -> np.ndarray:
+    """Align opportunity counts to a zone index.
+
+    Parameters
+    ----------
+    opportunity_df : pd.DataFrame
+        The opportunities, with a ``bg_id`` column and a column per opportunity
+    zones : array-like
+        The GEOIDs of the zones to align to
+    columns : List[str]
+        The opportunity columns to include
+
+    Returns
+    -------
+    np.ndarray
+        A zones by opportunities array, with 0 for zones without opportunity data
+    """
+    values, _ = ZoneIndex(zones).align(opportunity_df, columns)
+    return np.nan_to_num(values, nan=0.0)
+
+
+def _chunk_access_curves(chunk: np.ndarray, opportunities: np.ndarray, n_minutes: int):
+    """Count the opportunities reachable within each minute for a chunk of origins"""
+    n_rows = chunk.shape[0]
+    # One bin per minute, plus one for everything later (including unreachable)
+    n_bins = n_minutes + 1
+    bins = np.minimum(chunk, n_bins - 1).astype(np.int64)
+    bins += np.arange(n_rows)[:, np.newaxis] * n_bins
+    bins = bins.ravel()
+    curves = np.zeros((n_rows, opportunities.shape[1], n_minutes))
+    for k in range(opportunities.shape[1]):
+        counts = np.bincount(
+            bins,
+            weights=np.tile(opportunities[:, k], n_rows),
+            minlength=n_rows * n_bins,
+        ).reshape(n_rows, n_bins)
+        # Drop the overflow bin before accumulating
+        curves[:, k] = np.cumsum(counts[:, :-1], axis=1)
+    return curves
+
+
+def _iter_access_curves(
+    travel_times: np.ndarray,
+    opportunities: np.ndarray,
+    max_time: int,
+    chunk_size: int = ORIGIN_CHUNK_SIZE,
+):
+    """Generate the access curves of a chunk of origins at a time"""
+    unreachable = unreachable_value(travel_times.dtype)
+    n_minutes = int(min(max_time, unreachable - 1)) + 1
+    for start in range(0, travel_times.shape[0], chunk_size):
+        chunk = np.asarray(travel_times[start : start + chunk_size])
+        curves = np.empty((chunk.shape[0], opportunities.shape[1], max_time + 1))
+        curves[:, :, :n_minutes] = _chunk_access_curves(chunk, opportunities, n_minutes)
+        # Nothing more is reachable past the largest reachable time
+        curves[:, :, n_minutes:] = curves[:, :, n_minutes - 1 : n_minutes]
+        yield start, curves
+
+
+def write_access_curves(
+    travel_times: np.ndarray,
+    opportunities: np.ndarray,
+    max_time: int,
+    path: str,
+    chunk_size: int = ORIGIN_CHUNK_SIZE,
+):
+    """Count the opportunities reachable from each origin within every minute.
+
+    The curve gives the cumulative measure for any threshold up to ``max_time``
+    without another pass over the matrix. It is written a chunk of origins at a
+    time into an origins by opportunities by ``max_time + 1`` ``.npy`` file, as
+    32-bit unsigned integers when the opportunity counts are whole and their
+    totals fit, and as 32-bit floats otherwise.
+
+    Parameters
+    ----------
+    travel_times : np.ndarray
+        A dense origins by destinations matrix of travel times in minutes
+    opportunities : np.ndarray
+        A destinations by opportunities array of opportunity counts
+    max_time : int
+        The largest threshold, in minutes
+    path : str
+        The path of the ``.npy`` file to write
+    chunk_size : int, optional
+        The number of origins to process at a time, by default ``ORIGIN_CHUNK_SIZE``
+    """
+    dtype = np.float32
+    # A curve never exceeds the total count of its opportunity
+    if opportunities.size == 0 or (
+        np.array_equal(opportunities, np.round(opportunities))
+        and opportunities.min() >= 0
+        and opportunities.sum(axis=0).max() <= np.iinfo(np.uint32).max
+    ):
+        dtype = np.uint32
+    # Write to a temporary file first so readers never see partial curves
+    temporary_path = f"{path}.tmp"
+    curves = np.lib.format.open_memmap(
+        temporary_path,
+        mode="w+",
+        dtype=dtype,
+        shape=(travel_times.shape[0], opportunities.shape[1], max_time + 1),
+    )
+    for start, chunk_curves in _iter_access_curves(
+        travel_times, opportunities, max_time, chunk_size
+    ):
+        curves[start : start + chunk_curves.shape[0]] = chunk_curves
+    curves.flush()
+    del curves
+    os.replace(temporary_path, path)
+
+
+def curve_opportunities(opportunities: dict) -> List[str]:
+    """List the opportunities with access curves, in the order they are stored
+
+    Parameters
+    ----------
+    opportunities : dict
+        The ``opportunities`` section of an analysis configuration
+
+    Returns
+    -------
+    List[str]
+        The names of the opportunities with a cumulative method
+    """
+    return [
+        opportunity
+        for opportunity, settings in opportunities.items()
+        if settings["method"] == "cumulative"
+    ]
+
+
+def threshold_comparison(
+    curve_files: List[str],
+    origins,
+    opportunities: dict,
+    opportunity: str,
+    threshold: int,
+) -> pd.DataFrame:
+    """Compare the cumulative access to an opportunity within any threshold
+
+    The measures are read off the access curves of every scenario, so any
+    threshold the curves cover is available without recomputing the metrics.
+
+    Parameters
+    ----------
+    curve_files : List[str]
+        The paths of the access curves of each scenario, in scenario order
+    origins : array-like
+        The zone IDs of the curves' origins
+    opportunities : dict
+        The ``opportunities`` section of the analysis configuration
+    opportunity : str
+        The name of an opportunity with a cumulative method
+    threshold : int
+        The travel time threshold, in minutes
+
+    Returns
+    -------
+    pd.DataFrame
+        A dataframe in the format of the comparison file, with a ``bg_id`` row
+        per origin, a ``{opportunity}_c{threshold}_{idx}`` column for each
+        scenario and a ``{opportunity}_c{threshold}_{b}-{a}`` column for every
+        pair of scenarios
+
+    Raises
+    ------
+    KeyError
+        Raised when the opportunity has no access curves or the threshold is
+        outside them
+    """
+    if opportunity not in curve_opportunities(opportunities):
+        raise KeyError(f"There are no access curves for {opportunity}")
+    column = curve_opportunities(opportunities).index(opportunity)
+    curves = [open_matrix(path) for path in curve_files]
+    if threshold < 0 or threshold >= curves[0].shape[2]:
+        raise KeyError(f"There are no access curves for {threshold} minutes")
+
+    values = np.stack([curve[:, column, threshold] for curve in curves])
+    values = values.astype("float64")
+    pairs, differences = scenario_differences(values)
+    metric = f"{opportunity}_c{threshold}"
+    columns = {"bg_id": np.asarray(origins, dtype=str)}
+    for idx in range(values.shape[0]):
+        columns[f"{metric}_{idx}"] = values[idx]
+    for pair_idx, pair in enumerate(pairs):
+        columns[f"{metric}_{pair[1]}-{pair[0]}"] = differences[pair_idx]
+    result = pd.DataFrame(columns)
+    if np.issubdtype(curves[0].dtype, np.integer):
+        result[result.columns[1:]] = result[result.columns[1:]].astype("int64")
+    return result
+
+
+def travel_time_measures(
+    travel_times: np.ndarray,
+    opportunities: np.ndarray,
+    ns: List[List[int]],
+    chunk_size: int = ORIGIN_CHUNK_SIZE,
+) -> List[np.ndarray]:
+    """Find the travel time from each origin to its nth nearest opportunity.
+
+    Each origin's travel times to destinations with opportunities are sorted
+    once, the opportunities are summed cumulatively in that order, and the nth
+    nearest opportunity is found by searching the cumulative sum for every n.
+
+    Parameters
+    ----------
+    travel_times : np.ndarray
+        A dense origins by destinations matrix of travel times in minutes
+    opportunities : np.ndarray
+        A destinations by opportunities array of opportunity counts
+    ns : List[List[int]]
+        For each opportunity column, the values of n to find the nth nearest for
+    chunk_size : int, optional
+        The number of origins to process at a time, by default ``ORIGIN_CHUNK_SIZE``
+
+    Returns
+    -------
+    List[np.ndarray]
+        For each opportunity column, an origins by ns array of the travel time to
+        the nth nearest opportunity, or NaN when fewer than n are reachable
+    """
+    n_origins = travel_times.shape[0]
+    unreachable = unreachable_value(travel_times.dtype)
+    results = [np.full((n_origins, len(n)), np.nan) for n in ns]
+
+    for k, opportunity_ns in enumerate(ns):
+        if len(opportunity_ns) == 0:
+            continue
+        # Only destinations with opportunities can be the nth nearest
+        destinations = np.flatnonzero(opportunities[:, k] > 0)
+        if destinations.shape[0] == 0:
+            continue
+        weights = opportunities[destinations, k]
+        for start in range(0, n_origins, chunk_size):
+            chunk = np.asarray(travel_times[start : start + chunk_size])
+            chunk = chunk[:, destinations]
+            order = np.argsort(chunk, axis=1, kind="stable")
+            times = np.take_along_axis(chunk, order, axis=1)
+            reachable_weights = np.where(times != unreachable, weights[order], 0)
+            cumulative = np.cumsum(reachable_weights, axis=1)
+            for column, n in enumerate(opportunity_ns):
+                # The position of the first destination reaching n opportunities
+                position = (cumulative < n).sum(axis=1)
+                found = position < times.shape[1]
+                nth_time = np.take_along_axis(
+                    times, np.minimum(position, times.shape[1] - 1)[:, None], axis=1
+                )[:, 0]
+                results[k][start : start + chunk.shape[0], column] = np.where(
+                    found, nth_time, np.nan
+                )
+    return results
+
+
+def scenario_differences(values: np.ndarray):
+    """Compute the differences between every pair of scenarios at once.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        A scenarios by zones by metrics array of metric values
+
+    Returns
+    -------
+    tuple
+        The ``(a, b)`` scenario index pairs, with ``a < b``, and a pairs by zones by
+        metrics array of the differences ``b - a``
+    """
+    pairs = list(combinations(range(values.shape[0]), 2))
+    a = [pair[0] for pair in pairs]
+    b = [pair[1] for pair in pairs]
+    return pairs, values[b] - values[a]
+
+
+def weighted_summaries(
+    values: np.ndarray, weights: np.ndarray, quantiles: List[float], bins: int
+):
+    """Summarize every metric for every population group in one pass.
+
+    Missing values and weights are left out, as a pandas sum would skip them.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        A zones by metrics array of metric values
+    weights : np.ndarray
+        A zones by groups array of population weights, each column summing to 1
+    quantiles : List[float]
+        The quantiles to find, between 0 and 1
+    bins : int
+        The number of equal-width histogram bins to use for each metric
+
+    Returns
+    -------
+    tuple
+        A metrics by groups array of weighted means, a metrics by groups by
+        quantiles array of weighted quantiles (NaN for a group with no weight),
+        a metrics by bins + 1 array of histogram bin edges, and a metrics by bins
+        by groups array of the share of each group's weight in each bin
+    """
+    # Keep 32-bit floats in 32 bits
+    values = np.asarray(values)
+    values = values.astype(np.result_type(values.dtype, np.float32))
+    weights = np.asarray(weights)
+    weights = np.nan_to_num(weights.astype(np.result_type(weights.dtype, np.float32)))
+    quantiles = np.asarray(quantiles, dtype="float64")
+    n_metrics = values.shape[1]
+    n_groups = weights.shape[1]
+
+    means = np.nan_to_num(values).T @ weights
+    metric_quantiles = np.full(
+        (n_metrics, n_groups, len(quantiles)), np.nan, dtype=values.dtype
+    )
+    edges = np.full((n_metrics, bins + 1), np.nan)
+    histograms = np.zeros((n_metrics, bins, n_groups), dtype=weights.dtype)
+    for metric in range(n_metrics):
+        valid = ~np.isnan(values[:, metric])
+        if not valid.any():
+            continue
+        metric_values = values[valid, metric]
+        metric_weights = weights[valid]
+
+        # The smallest value with at least the quantile's share of the weight
+        order = np.argsort(metric_values, kind="stable")
+        cumulative = np.cumsum(metric_weights[order], axis=0)
+        total = cumulative[-1]
+        below = (
+            cumulative[:, :, np.newaxis]
+            < quantiles[np.newaxis, np.newaxis, :] * total[np.newaxis, :, np.newaxis]
+        ).sum(axis=0)
+        found = metric_values[order][np.minimum(below, len(metric_values) - 1)]
+        metric_quantiles[metric] = np.where(total[:, np.newaxis] > 0, found, np.nan)
+
+        edges[metric] = np.histogram_bin_edges(metric_values, bins=bins)
+        bin_idx = np.clip(
+            np.searchsorted(edges[metric], metric_values, side="right") - 1, 0, bins - 1
+        )
+        np.add.at(histograms[metric], bin_idx, metric_weights)
+    return means, metric_quantiles, edges, histograms
+
+
+class MetricsEngine:
+    """Compute access to opportunity metrics from a dense travel time matrix
+
+    The matrix is loaded once, with its rows and columns indexed by zone, and the
+    opportunities are aligned to its destinations as a zones by opportunities
+    matrix. Every cumulative measure sharing a threshold is then the product of
+    that threshold's reachability matrix with the opportunities matrix, so all
+    cumulative measures come out of one matrix product per distinct threshold.
+
+    The engine can be used on its own, for example in a notebook::
+
+        engine = MetricsEngine.from_files(
+            "cache/<uid>/matrix0.npy",
+            "cache/<uid>/zones.csv",
+            "cache/<uid>/opportunities.csv",
+        )
+        engine.cumulative({"jobs": [30, 45]})
+
+    Parameters
+    ----------
+    travel_times : np.ndarray
+        A dense origins by destinations matrix of travel times in minutes
+    origins : array-like
+        The zone IDs of the matrix rows
+    destinations : array-like
+        The zone IDs of the matrix columns
+    opportunity_df : pd.DataFrame
+        The opportunities, with a ``bg_id`` column and a column per opportunity
+    chunk_size : int, optional
+        The number of origins to process at a time, by default ``ORIGIN_CHUNK_SIZE``
+    dtype : str, optional
+        The floating point type of the computations and metrics, by default
+        ``float64``. With ``float32``, whole-number counts are ``int32`` and sums
+        above 2^24 may be rounded.
+    """
+
+    def __init__(
+        self,
+        travel_times: np.ndarray,
+        origins,
+        destinations,
+        opportunity_df: pd.DataFrame,
+        chunk_size: int = ORIGIN_CHUNK_SIZE,
+        dtype: str = "float64",
+    ):
+        self.travel_times = travel_times
+        self.origins = np.asarray(origins, dtype=str)
+        self.destinations = np.asarray(destinations, dtype=str)
+        self.opportunity_df = opportunity_df
+        self.chunk_size = chunk_size
+        self.dtype = np.dtype(dtype)
+        self.integer_dtype = np.dtype(f"int{self.dtype.itemsize * 8}")
+        self.opportunity_columns = [c for c in opportunity_df.columns if c != "bg_id"]
+        self.opportunities = opportunity_matrix(
+            opportunity_df, self.destinations, self.opportunity_columns
+        ).astype(self.dtype)
+
+    @classmethod
+    def from_files(cls, matrix_file: str, zones_file: str, opportunities_file: str):
+        """Create an engine from a project's matrix, zone index and opportunities files
+
+        Parameters
+        ----------
+        matrix_file : str
+            Path to the dense ``.npy`` travel time matrix
+        zones_file : str
+            Path to the ``zones.csv`` zone index
+        opportunities_file : str
+            Path to the ``opportunities.csv`` file
+
+        Returns
+        -------
+        MetricsEngine
+            The engine, with the matrix memory-mapped
+        """
+        origins, destinations = read_matrix_zones(zones_file)
+        opportunity_df = pd.read_csv(opportunities_file, dtype={"bg_id": str})
+        return cls(open_matrix(matrix_file), origins, destinations, opportunity_df)
+
+    def _opportunity_index(self, names: List[str]) -> List[int]:
+        """The opportunities matrix columns of a list of opportunity names"""
+        return [self.opportunity_columns.index(name) for name in names]
+
+    def cumulative(self, thresholds: dict, rows: slice = slice(None)) -> pd.DataFrame:
+        """Count the opportunities reachable from each origin within each threshold.
+
+        Parameters
+        ----------
+        thresholds : dict
+            A list of travel time threshold cutoffs, in minutes, keyed by the
+            name of the opportunity
+        rows : slice, optional
+            The matrix rows (origins) to compute, by default all of them
+
+        Returns
+        -------
+        pd.DataFrame
+            A dataframe with a ``bg_id`` row per origin and a
+            ``{opportunity}_c{threshold}`` column for every opportunity and
+            threshold
+        """
+        travel_times = self.travel_times[rows]
+        origins = self.origins[rows]
+        unreachable = unreachable_value(travel_times.dtype)
+        by_threshold = dict()
+        for name, opportunity_thresholds in thresholds.items():
+            for threshold in opportunity_thresholds:
+                by_threshold.setdefault(threshold, []).append(name)
+
+        values = dict()
+        for threshold, names in by_threshold.items():
+            values[threshold] = np.zeros((len(origins), len(names)), dtype=self.dtype)
+        for start in range(0, len(origins), self.chunk_size):
+            chunk = np.asarray(travel_times[start : start + self.chunk_size])
+            for threshold, names in by_threshold.items():
+                # Unreachable pairs are never within a threshold
+                cutoff = min(threshold, unreachable - 1)
+                reachable = (chunk <= cutoff).astype(self.dtype)
+                opportunities = self.opportunities[:, self._opportunity_index(names)]
+                values[threshold][start : start + chunk.shape[0]] = (
+                    reachable @ opportunities
+                )
+
+        columns = {"bg_id": origins}
+        for name, opportunity_thresholds in thresholds.items():
+            for threshold in opportunity_thresholds:
+                column = by_threshold[threshold].index(name)
+                columns[f"{name}_c{threshold}"] = values[threshold][:, column]
+        result = pd.DataFrame(columns)
+        # Keep whole-number counts for whole-number opportunities
+        for name, opportunity_thresholds in thresholds.items():
+            if pd.api.types.is_integer_dtype(self.opportunity_df[name]):
+                for threshold in opportunity_thresholds:
+                    result[f"{name}_c{threshold}"] = result[
+                        f"{name}_c{threshold}"
+                    ].astype(self.integer_dtype)
+        return result
+
+    def travel_time(self, ns: dict, rows: slice = slice(None)) -> pd.DataFrame:
+        """Find the travel time from each origin to its nth nearest opportunities.
+
+        Parameters
+        ----------
+        ns : dict
+            A list of the nth nearest items to use (e.g. 1 is closest, 3 is 3rd
+            closest), keyed by the name of the opportunity
+        rows : slice, optional
+            The matrix rows (origins) to compute, by default all of them
+
+        Returns
+        -------
+        pd.DataFrame
+            A dataframe with a ``bg_id`` row per origin and a ``{opportunity}_t{n}``
+            column for every opportunity and n, which is NaN when unreachable
+        """
+        names = list(ns.keys())
+        times = travel_time_measures(
+            self.travel_times[rows],
+            self.opportunities[:, self._opportunity_index(names)],
+            [ns[name] for name in names],
+            chunk_size=self.chunk_size,
+        )
+        columns = {"bg_id": self.origins[rows]}
+        for name, values in zip(names, times):
+            for column, n in enumerate(ns[name]):
+                columns[f"{name}_t{n}"] = values[:, column].astype(self.dtype)
+        return pd.DataFrame(columns)
+
+    def write_access_curves(self, names: List[str], max_time: int, path: str):
+        """Write the counts of opportunities reachable within every minute.
+
+        See :func:`write_access_curves`; only one chunk of origins is held in
+        memory at a time.
+
+        Parameters
+        ----------
+        names : List[str]
+            The names of the opportunities, in the order to store them
+        max_time : int
+            The largest threshold, in minutes
+        path : str
+            The path of the ``.npy`` file to write
+        """
+        write_access_curves(
+            self.travel_times,
+            self.opportunities[:, self._opportunity_index(names)],
+            max_time,
+            path,
+            chunk_size=self.chunk_size,
+        )
+
+    def compute(self, opportunities: dict, rows: slice = slice(None)) -> pd.DataFrame:
+        """Compute every configured metric.
+
+        Parameters
+        ----------
+        opportunities : dict
+            The ``opportunities`` section of an analysis configuration, giving the
+            ``method`` (``cumulative`` or ``travel_time``) and ``parameters`` of
+            each opportunity
+        rows : slice, optional
+            The matrix rows (origins) to compute, by default all of them
+
+        Returns
+        -------
+        pd.DataFrame
+            A dataframe with a ``bg_id`` row per origin and a column per metric,
+            in configuration order
+
+        Raises
+        ------
+        KeyError
+            Raised when an opportunity has an invalid method
+        """
+        cumulative = dict()
+        travel_time = dict()
+        columns = ["bg_id"]
+        for opportunity, settings in opportunities.items():
+            if settings["method"] == "cumulative":
+                cumulative[opportunity] = settings["parameters"]
+                columns += [f"{opportunity}_c{p}" for p in settings["parameters"]]
+            elif settings["method"] == "travel_time":
+                travel_time[opportunity] = settings["parameters"]
+                columns += [f"{opportunity}_t{p}" for p in settings["parameters"]]
+            else:
+                raise KeyError(
+                    f"Invalid method specification {settings['method']} for metrics calculation"
+                )
+
+        result = pd.DataFrame({"bg_id": self.origins[rows]})
+        if len(cumulative) > 0:
+            cumulative_df = self.cumulative(cumulative, rows)
+            result = result.join(cumulative_df.drop(columns="bg_id"))
+        if len(travel_time) > 0:
+            travel_time_df = self.travel_time(travel_time, rows)
+            result = result.join(travel_time_df.drop(columns="bg_id"))
+        return result[columns]
+
+    def iter_compute(self, opportunities: dict):
+        """Compute every configured metric a chunk of origins at a time.
+
+        Only one chunk of the matrix and of the results is held in memory at a
+        time, so the peak memory depends on the chunk size rather than on the
+        size of the matrix. Concatenating the chunks gives the result of
+        :meth:`compute`.
+
+        Parameters
+        ----------
+        opportunities : dict
+            The ``opportunities`` section of an analysis configuration
+
+        Yields
+        ------
+        pd.DataFrame
+            The metrics of the next ``chunk_size`` origins, in matrix row order
+        """
+        for start in range(0, len(self.origins), self.chunk_size):
+            yield self.compute(opportunities, slice(start, start + self.chunk_size))
@@ -0,0 +1,154 @@
+"""
+A persistent cache of built R5 transport networks, shared across analyses.
+
+Networks are keyed by a hash of the OpenStreetMap file and the sorted hashes of
+the GTFS files they are built from, so a scenario using byte-identical inputs
+reloads the serialized network instead of building it again. The cache is kept
+under a maximum size by evicting the least recently used networks.
+"""
+
+import hashlib
+import logging
+import os
+from typing import List
+
+import jpype
+from r5py import TransportNetwork
+
+from .util import hash_file
+
+#: File extension of serialized networks
+NETWORK_EXTENSION = ".dat"
+
+
+class CachedTransportNetwork(TransportNetwork):
+    """A transport network reloaded from a serialized file instead of source data"""
+
+    def __init__(self, path):
+        serializer = jpype.JClass("com.conveyal.r5.kryo.KryoNetworkSerializer")
+        self._transport_network = serializer.read(jpype.JClass("java.io.File")(path))
+
+    def __del__(self):
+        # There is no OSM file to close for a reloaded network
+        pass
+
+
+class NetworkCache:
+    """An on-disk, size-bounded cache of R5 transport networks
+
+    Parameters
+    ----------
+    folder : str
+        The folder to store serialized networks in
+    max_size : int
+        The maximum total size of the cache, in bytes
+    log : logging.Logger, optional
+        The logger to report cache activity to
+    """
+
+    def __init__(self, folder: str, max_size: int, log: logging.Logger = None):
+        self.folder = folder
+        self.max_size = max_size
+        self.log = log if log is not None else logging.getLogger(__name__)
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+    @staticmethod
+    def key(osm_file: str, gtfs_files: List[str]) -> str:
+        """Compute the cache key for a set of network inputs
+
+        Parameters
+        ----------
+        osm_file : str
+            Path to the OpenStreetMap PBF file
+        gtfs_files : List[str]
+            Paths to the GTFS zip files
+
+        Returns
+        -------
+        str
+            A hash of the OSM file contents and the sorted GTFS file hashes
+        """
+        digest = hashlib.sha256(hash_file(osm_file).encode())
+        for gtfs_hash in sorted(hash_file(g) for g in gtfs_files):
+            digest.update(gtfs_hash.encode())
+        return digest.hexdigest()
+
+    def get(self, osm_file: str, gtfs_files: List[str]) -> TransportNetwork:
+        """Fetch a transport network from the cache, building it on a miss
+
+        Parameters
+        ----------
+        osm_file : str
+            Path to the OpenStreetMap PBF file
+        gtfs_files : List[str]
+            Paths to the GTFS zip files
+
+        Returns
+        -------
+        TransportNetwork
+            The transport network built from the given inputs
+        """
+        key = self.key(osm_file, gtfs_files)
+        path = os.path.join(self.folder, f"{key}{NETWORK_EXTENSION}")
+        if os.path.exists(path):
+            self.log.debug(f"  Loading cached network {key}")
+            # Mark the network as recently used
+            os.utime(path)
+            return CachedTransportNetwork(path)
+
+        self.log.debug(f"  No cached network for {key}, building it")
+        network = TransportNetwork(osm_file, gtfs_files)
+        self.put(network, path)
+        return network
+
+    def put(self, network: TransportNetwork, path: str):
+        """Serialize a transport network into the cache and evict old networks
+
+        Parameters
+        ----------
+        network : TransportNetwork
+            The network to serialize
+        path : str
+            The cache path to write the network to
+        """
+        serializer = jpype.JClass("com.conveyal.r5.kryo.KryoNetworkSerializer")
+        # Write to a temporary file first so readers never see a partial network
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            serializer.write(
+                network._transport_network, jpype.JClass("java.io.File")(temporary_path)
+            )
+            os.replace(temporary_path, path)
+        except Exception as e:
+            self.log.warning(f"  Unable to cache network: {e}")
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            return
+        self.evict(keep=path)
+
+    def evict(self, keep: str = None):
+        """Remove the least recently used networks until the cache fits its size
+
+        Parameters
+        ----------
+        keep : str, optional
+            A network path to never evict, such as the one just written
+        """
+        entries = []
+        for filename in os.listdir(self.folder):
+            if not filename.endswith(NETWORK_EXTENSION):
+                continue
+            path = os.path.join(self.folder, filename)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            self.log.debug(f"  Evicting cached network {os.path.basename(path)}")
+            os.remove(path)
+            total_size -= size
@@ -1,5 +1,6 @@
-from r5py import TransportMode
+import hashlib
 
+from r5py import TransportMode
 
 transit_mode = {
     "TRANSIT": {
@@ -77,3 +78,25 @@ age_categories = [
     "B01001_048E",
     "B01001_049E",
 ]
+
+
+def hash_file(path, chunk_size: int = 2**20) -> str:
+    """Compute the SHA-256 hash of a file's contents.
+
+    Parameters
+    ----------
+    path : str
+        Path to the file to hash
+    chunk_size : int, optional
+        The number of bytes to read at a time, by default 1 MiB
+
+    Returns
+    -------
+    str
+        The hexadecimal digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
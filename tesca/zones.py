@@ -0,0 +1,151 @@
+"""
+A compact index of an analysis's zones.
+
+Block group GEOIDs are 12-digit strings, which fit in an int64. The zone index
+encodes them once and keeps them sorted, so finding zones is a binary search over
+integers and aligning a table to the zones is an array lookup rather than a
+string join. Strings are only used at the edges, when reading and writing files.
+"""
+
+import numpy as np
+import pandas as pd
+
+#: Number of digits in a block group GEOID
+GEOID_LENGTH = 12
+
+
+def encode_geoids(ids) -> np.ndarray:
+    """Encode block group GEOIDs as integers.
+
+    Parameters
+    ----------
+    ids : array-like
+        The GEOIDs, as strings
+
+    Returns
+    -------
+    np.ndarray
+        The int64 GEOIDs, with -1 for anything that is not a 12-digit GEOID
+    """
+    ids = pd.Series(np.asarray(ids, dtype=str))
+    valid = ids.str.fullmatch(rf"\d{{{GEOID_LENGTH}}}").to_numpy(dtype=bool)
+    codes = np.full(len(ids), -1, dtype=np.int64)
+    codes[valid] = ids[valid].astype(np.int64).to_numpy()
+    return codes
+
+
+def decode_geoids(codes) -> np.ndarray:
+    """Decode integer block group GEOIDs back to strings.
+
+    Parameters
+    ----------
+    codes : array-like
+        The int64 GEOIDs
+
+    Returns
+    -------
+    np.ndarray
+        The zero-padded 12-digit GEOIDs
+    """
+    return np.char.zfill(np.asarray(codes, dtype=np.int64).astype(str), GEOID_LENGTH)
+
+
+class ZoneIndex:
+    """The zones of an analysis, numbered 0 to N - 1
+
+    Parameters
+    ----------
+    ids : array-like
+        The GEOIDs of the zones, in index order. IDs that are not 12-digit GEOIDs
+        keep their position but are never found by a lookup.
+    """
+
+    def __init__(self, ids):
+        self.ids = np.asarray(ids, dtype=str)
+        self.codes = encode_geoids(self.ids)
+        self._order = np.argsort(self.codes, kind="stable")
+        self._sorted = self.codes[self._order]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def positions(self, ids) -> np.ndarray:
+        """Find the positions of zones in the index.
+
+        Parameters
+        ----------
+        ids : array-like
+            The GEOIDs to find
+
+        Returns
+        -------
+        np.ndarray
+            The position of each zone, or -1 for zones that are not in the index
+        """
+        codes = encode_geoids(ids)
+        if len(self._sorted) == 0:
+            return np.full(len(codes), -1, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self._sorted, codes), len(self._sorted) - 1)
+        found = (self._sorted[idx] == codes) & (codes >= 0)
+        return np.where(found, self._order[idx], -1)
+
+    def contains(self, ids) -> np.ndarray:
+        """Check which zones are in the index.
+
+        Parameters
+        ----------
+        ids : array-like
+            The GEOIDs to check
+
+        Returns
+        -------
+        np.ndarray
+            True for each zone in the index
+        """
+        return self.positions(ids) >= 0
+
+    def mask(self, ids) -> np.ndarray:
+        """Flag the indexed zones that are in a list of zones.
+
+        Parameters
+        ----------
+        ids : array-like
+            The GEOIDs to flag
+
+        Returns
+        -------
+        np.ndarray
+            A boolean array over the index, True for the zones in ``ids``
+        """
+        result = np.zeros(len(self), dtype=bool)
+        positions = self.positions(ids)
+        result[positions[positions >= 0]] = True
+        return result
+
+    def align(
+        self, df: pd.DataFrame, columns, id_column: str = "bg_id", dtype="float64"
+    ):
+        """Align the columns of a table to the index.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The table, with a column of GEOIDs
+        columns : List[str]
+            The columns to align
+        id_column : str, optional
+            The column of GEOIDs, by default ``bg_id``
+        dtype : str, optional
+            The floating point type of the aligned values, by default ``float64``
+
+        Returns
+        -------
+        tuple
+            A zones by columns float array, with NaN for the zones missing from
+            the table, and a boolean array flagging the zones in the table
+        """
+        positions = self.positions(df[id_column])
+        found = positions >= 0
+        values = np.full((len(self), len(columns)), np.nan, dtype=dtype)
+        values[positions[found]] = df.loc[found, columns].to_numpy(dtype=dtype)
+        return values, self.mask(df[id_column])
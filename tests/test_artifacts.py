@@ -0,0 +1,113 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from tesca.analysis import (
+    Analysis,
+    CACHE_FOLDER,
+    METRIC_CACHE_SUBFOLDER,
+    OPPORTUNITIES_FILENAME,
+    ZONES_FILENAME,
+)
+from tesca.matrix import write_zones
+
+
+def test_artifact_hand_off(analysis_config):
+    a = Analysis(analysis_config)
+    df = pd.DataFrame({"bg_id": ["010010201001", "010010201002"], "jobs": [1, 2]})
+    a.write_artifact("artifact.csv", df, index=False)
+    # Later stages read the table from memory, even before its file is written
+    pd.testing.assert_frame_equal(a.read_artifact("artifact.csv"), df)
+    a.flush_artifacts()
+    written = pd.read_csv(
+        os.path.join(CACHE_FOLDER, analysis_config["uid"], "artifact.csv"),
+        dtype={"bg_id": str},
+    )
+    pd.testing.assert_frame_equal(written, df)
+    shutil.rmtree(os.path.join(CACHE_FOLDER, analysis_config["uid"]))
+
+
+def test_artifact_reread_after_file_changes(analysis_config):
+    a = Analysis(analysis_config)
+    df = pd.DataFrame({"bg_id": ["010010201001"], "jobs": [1]})
+    a.write_artifact("artifact.csv", df, index=False)
+    a.flush_artifacts()
+    edited = pd.DataFrame({"bg_id": ["010010201001", "010010201002"], "jobs": [3, 4]})
+    edited.to_csv(os.path.join(a.cache_folder, "artifact.csv"), index=False)
+    pd.testing.assert_frame_equal(a.read_artifact("artifact.csv"), edited)
+    shutil.rmtree(a.cache_folder)
+
+
+def test_artifacts_dropped_in_memory_lean_mode(analysis_config):
+    a = Analysis(dict(analysis_config, memory_lean=True))
+    df = pd.DataFrame({"bg_id": ["010010201001"], "jobs": [1]})
+    a.write_artifact("artifact.csv", df, index=False)
+    a.flush_artifacts()
+    assert "artifact.csv" not in a._artifacts
+    assert a.read_artifact("artifact.csv")["jobs"].dtype == np.int32
+    shutil.rmtree(a.cache_folder)
+
+
+def test_table_memory_without_lean_types(analysis_config):
+    path = os.path.join(CACHE_FOLDER, analysis_config["uid"], "artifact.csv")
+    lean = Analysis(dict(analysis_config, memory_lean=True))
+    pd.DataFrame(
+        {
+            "bg_id": ["010010201001", "010010201002", None],
+            "jobs": [1, 2, 3],
+            "time": [1.5, 2.5, 3.5],
+        }
+    ).to_csv(path, index=False)
+    df = lean.read_artifact("artifact.csv")
+    normal = pd.read_csv(path, dtype={"bg_id": str})
+    used, full = Analysis.table_memory(df)
+    assert used == df.memory_usage(deep=True).sum()
+    # The estimate matches the table read without memory-lean mode
+    assert full == normal.memory_usage(deep=True).sum()
+    assert used < full
+    shutil.rmtree(lean.cache_folder)
+
+
+def test_discarded_artifact_not_written(analysis_config):
+    a = Analysis(analysis_config)
+    df = pd.DataFrame({"bg_id": ["010010201001"], "jobs": [1]})
+    a.write_artifact("artifact.csv", df, index=False)
+    a.discard_artifact("artifact.csv")
+    streamed = pd.DataFrame({"bg_id": ["010010201002"], "jobs": [2]})
+    streamed.to_csv(os.path.join(a.cache_folder, "artifact.csv"), index=False)
+    a.flush_artifacts()
+    pd.testing.assert_frame_equal(a.read_artifact("artifact.csv"), streamed)
+    shutil.rmtree(a.cache_folder)
+
+
+def test_streamed_metrics_keep_cache(analysis_config):
+    config = dict(
+        analysis_config,
+        opportunities={"jobs": {"method": "cumulative", "parameters": [30]}},
+        access_curves=False,
+    )
+    a = Analysis(config)
+    zones = ["010010201001", "010010201002"]
+    for idx in range(len(config["scenarios"])):
+        np.save(
+            os.path.join(a.cache_folder, f"matrix{idx}.npy"),
+            np.array([[0, 20 + idx], [40, 0]], dtype=np.uint8),
+        )
+    write_zones(zones, os.path.join(a.cache_folder, ZONES_FILENAME))
+    pd.DataFrame({"bg_id": zones, "jobs": [1, 2]}).to_csv(
+        os.path.join(a.cache_folder, OPPORTUNITIES_FILENAME), index=False
+    )
+    cache_folder = os.path.join(a.cache_folder, METRIC_CACHE_SUBFOLDER)
+
+    a.compute_metrics()
+    a.flush_artifacts()
+    cached = sorted(os.listdir(cache_folder))
+    assert len(cached) == len(config["scenarios"])
+
+    # A streamed run does not know which columns are in use, so keeps them all
+    a.config["stream_metrics"] = True
+    a.compute_metrics()
+    assert sorted(os.listdir(cache_folder)) == cached
+    shutil.rmtree(a.cache_folder)
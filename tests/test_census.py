@@ -0,0 +1,107 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+import urllib.parse
+
+import pandas as pd
+import pytest
+
+from tesca.census import CensusClient, fetch_demographics
+from tesca.census_cache import CensusCache
+from tesca.util import total_hhld, zero_car_hhld
+
+
+@pytest.fixture
+def census_server():
+    """A fake Census API with two tracts of two block groups in each county"""
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+            requests.append(query)
+            # Fail the first request to exercise retries
+            if len(requests) == 1:
+                self.send_response(503)
+                self.end_headers()
+                return
+            variables = query["get"][0].split(",")
+            level = query["for"][0].split(":")[0]
+            within = dict(part.split(":") for part in query["in"][0].split(" "))
+            if level == "tract":
+                header = variables + ["state", "county", "tract"]
+                rows = [
+                    ["10", within["state"], within["county"], "000100"],
+                    ["6", within["state"], within["county"], "000200"],
+                ]
+            else:
+                header = variables + ["state", "county", "tract", "block group"]
+                rows = []
+                for tract in ["000100", "000200"]:
+                    for bg, households in [("1", 30), ("2", 10)]:
+                        values = [
+                            str(households) if v == total_hhld else "1"
+                            for v in variables
+                        ]
+                        rows.append(
+                            values + [within["state"], within["county"], tract, bg]
+                        )
+            body = json.dumps([header] + rows).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", requests
+    server.shutdown()
+
+
+def test_fetch_demographics(census_server):
+    url, requests = census_server
+    client = CensusClient("key", base_url=url, backoff=0)
+    counties = pd.DataFrame({"state": ["42", "42"], "county": ["003", "005"]})
+    result = fetch_demographics(client, counties, workers=4)
+
+    # One retried request, then a block group and a tract request per county
+    assert len(requests) == 5
+    assert all(query["key"] == ["key"] for query in requests)
+    assert result.shape[0] == 8
+    assert result["GEOID"].iloc[0] == "420030001001"
+    assert (result["in_poverty"] == 2).all()
+    assert (result["age_65p"] == 12).all()
+    # Tract zero-car households are split by the share of households
+    assert result["zero_car_hhld"].tolist() == [8, 2, 4, 2] * 2
+    assert zero_car_hhld not in result.columns
+
+
+def test_census_cache(census_server, tmp_path):
+    url, requests = census_server
+    counties = pd.DataFrame({"state": ["42"], "county": ["003"]})
+    cache = CensusCache(tmp_path / "census", 2**20)
+    client = CensusClient("key", base_url=url, backoff=0, cache=cache)
+    expected = fetch_demographics(client, counties)
+    assert (cache.hits, cache.misses) == (0, 2)
+    downloads = len(requests)
+
+    # Repeat fetches are served from disk, even offline
+    cache = CensusCache(tmp_path / "census", 2**20, offline=True)
+    client = CensusClient("other key", base_url=url, cache=cache)
+    pd.testing.assert_frame_equal(fetch_demographics(client, counties), expected)
+    assert (cache.hits, cache.misses) == (2, 0)
+    assert len(requests) == downloads
+
+    other_counties = pd.DataFrame({"state": ["42"], "county": ["005"]})
+    with pytest.raises(RuntimeError):
+        fetch_demographics(client, other_counties)
+
+    # The least recently used responses are evicted to fit the size limit
+    cache = CensusCache(tmp_path / "census", 0)
+    cache.put("new", [["header"]])
+    assert os.listdir(tmp_path / "census") == ["new.json"]
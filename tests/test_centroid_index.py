@@ -0,0 +1,26 @@
+import os
+
+os.environ["USE_PYGEOS"] = "0"
+
+import geopandas as gpd
+from shapely.geometry import Point
+
+from tesca.centroid_index import CentroidIndex
+
+
+def test_centroid_index(tmp_path):
+    source = str(tmp_path / "centroids.gpkg")
+    ids = ["420030001002", "170010001001", "420030001001"]
+    gpd.GeoDataFrame(
+        {"bg_id": ids},
+        geometry=[Point(i, -i) for i in range(len(ids))],
+        crs="EPSG:4326",
+    ).to_file(source, layer="centroids")
+
+    index = CentroidIndex.open(source, "centroids", str(tmp_path / "index"))
+    assert index.codes.tolist() == sorted(int(i) for i in ids)
+    result = index.lookup(["420030001002", "170010001001", "060010001001", "bad"])
+    assert result["id"].tolist() == ["170010001001", "420030001002"]
+    assert result.geometry.x.tolist() == [1.0, 0.0]
+    assert result.geometry.y.tolist() == [-1.0, 0.0]
+    assert result.crs == "EPSG:4326"
@@ -0,0 +1,78 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from tesca.analysis import Analysis
+
+ZONES = ["010010201001", "010010201002", "010010201003"]
+
+
+@pytest.fixture
+def checkpoint_analysis(analysis_config):
+    config = dict(analysis_config, verbosity="INFO", max_time_walking=30)
+    for scenario in config["scenarios"]:
+        scenario["transit_modes"] = ["BUS"]
+    a = Analysis(config)
+    with open(os.path.join(a.cache_folder, "osm.pbf"), "wb") as outfile:
+        outfile.write(b"osm")
+    with open(os.path.join(a.cache_folder, "gtfs0", "feed.zip"), "wb") as outfile:
+        outfile.write(b"gtfs")
+    yield a
+    shutil.rmtree(a.cache_folder)
+
+
+def zones(ids):
+    return pd.DataFrame({"id": ids})
+
+
+def checkpoint(a, origins=ZONES, destinations=ZONES, batch_size=2):
+    """Prepare the checkpoints of the first scenario and leave a batch in them"""
+    folder = a.prepare_checkpoints(0, zones(origins), zones(destinations), batch_size)
+    with open(os.path.join(folder, "batch0.npy"), "wb") as outfile:
+        outfile.write(b"batch")
+    return folder
+
+
+def kept(a, origins=ZONES, destinations=ZONES, batch_size=2):
+    folder = a.prepare_checkpoints(0, zones(origins), zones(destinations), batch_size)
+    return os.path.exists(os.path.join(folder, "batch0.npy"))
+
+
+def test_batches_kept_when_unchanged(checkpoint_analysis):
+    checkpoint(checkpoint_analysis)
+    assert kept(checkpoint_analysis)
+
+
+def test_batches_discarded_when_zones_change(checkpoint_analysis):
+    checkpoint(checkpoint_analysis)
+    assert not kept(checkpoint_analysis, origins=ZONES[:2])
+    checkpoint(checkpoint_analysis)
+    assert not kept(checkpoint_analysis, destinations=ZONES[::-1])
+
+
+def test_batches_discarded_when_batch_size_changes(checkpoint_analysis):
+    checkpoint(checkpoint_analysis)
+    assert not kept(checkpoint_analysis, batch_size=1)
+
+
+def test_batches_discarded_when_gtfs_changes(checkpoint_analysis):
+    a = checkpoint_analysis
+    checkpoint(a)
+    with open(os.path.join(a.cache_folder, "gtfs0", "feed.zip"), "wb") as outfile:
+        outfile.write(b"new gtfs")
+    assert not kept(a)
+    # Adding a feed changes the network too
+    checkpoint(a)
+    with open(os.path.join(a.cache_folder, "gtfs0", "extra.zip"), "wb") as outfile:
+        outfile.write(b"extra gtfs")
+    assert not kept(a)
+
+
+def test_batches_kept_when_other_scenario_changes(checkpoint_analysis):
+    a = checkpoint_analysis
+    checkpoint(a)
+    with open(os.path.join(a.cache_folder, "gtfs1", "feed.zip"), "wb") as outfile:
+        outfile.write(b"other gtfs")
+    assert kept(a)
@@ -0,0 +1,34 @@
+import os
+
+os.environ["USE_PYGEOS"] = "0"
+
+import geopandas as gpd
+import pytest
+from shapely.geometry import Point
+
+from tesca.geometry_store import BlockGroupStore
+
+
+def test_block_group_store(tmp_path):
+    store = BlockGroupStore(tmp_path, 2021, download=False)
+    for state in ["17", "42"]:
+        ids = [f"{state}{county}000100{bg}" for county in ["001", "003"] for bg in "12"]
+        gpd.GeoDataFrame(
+            {"GEOID": ids}, geometry=[Point(i, i) for i in range(4)], crs="EPSG:4269"
+        ).to_parquet(os.path.join(store.folder, f"{state}.parquet"), index=False)
+    assert store.states() == ["17", "42"]
+
+    result = store.by_ids(["420030001002", "170010001001", "170010001001"])
+    assert result["GEOID"].tolist() == ["170010001001", "420030001002"]
+    assert result.crs == "EPSG:4269"
+
+    result = store.by_counties({"42": ["003"], "17": "001"})
+    assert result["GEOID"].tolist() == [
+        "420030001001",
+        "420030001002",
+        "170010001001",
+        "170010001002",
+    ]
+
+    with pytest.raises(KeyError):
+        store.by_ids(["060010001001"])
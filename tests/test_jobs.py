@@ -0,0 +1,17 @@
+import pandas as pd
+
+from tesca.jobs import JobsTable
+
+
+def test_jobs_table(tmp_path):
+    path = tmp_path / "jobs.csv.gz"
+    pd.DataFrame(
+        {
+            "bg_id": ["020130001002", "020130001001"],
+            "C000": [335, 193],
+            "state": ["02", "02"],
+        }
+    ).to_csv(path, index=False)
+    jobs = JobsTable.from_csv(path)
+    result = jobs.lookup(["020130001001", "020130001003", "020130001002"])
+    assert result.tolist() == [193, 0, 335]
@@ -0,0 +1,82 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from tesca.matrix import (
+    combine_matrices,
+    dense_matrix,
+    iter_matrix_csv,
+    open_matrix,
+    read_matrix_zones,
+    unreachable_value,
+    write_matrix,
+    write_zones,
+)
+
+ZONES = ["360470001001", "360470001002", "360470002001"]
+
+
+def make_matrix():
+    rows = [(a, b) for a in ZONES for b in ZONES]
+    matrix = pd.DataFrame(rows, columns=["from_id", "to_id"])
+    matrix["travel_time"] = np.arange(len(rows), dtype="float64")
+    matrix.loc[2, "travel_time"] = np.nan
+    return matrix
+
+
+def read_matrix(path, origins, destinations):
+    """Read a matrix file back the way it is downloaded"""
+    text = "".join(iter_matrix_csv(path, origins, destinations, chunk_size=2))
+    return pd.read_csv(io.StringIO(text), dtype={"from_id": str, "to_id": str})
+
+
+def test_matrix_round_trip(tmp_path):
+    matrix = make_matrix()
+    write_matrix(matrix, tmp_path / "matrix0.npy", ZONES, ZONES)
+    result = read_matrix(tmp_path / "matrix0.npy", ZONES, ZONES)
+    pd.testing.assert_frame_equal(result, matrix, check_dtype=False)
+
+
+def test_matrix_is_dense(tmp_path):
+    write_matrix(make_matrix(), tmp_path / "matrix0.npy", ZONES, ZONES)
+    dense = open_matrix(tmp_path / "matrix0.npy")
+    assert isinstance(dense, np.memmap)
+    assert dense.shape == (3, 3)
+    assert dense.dtype == np.uint8
+    assert dense[0, 2] == unreachable_value(dense.dtype)
+    assert dense[2, 1] == 7
+
+
+def test_dense_matrix_in_memory(tmp_path):
+    write_matrix(make_matrix(), tmp_path / "matrix0.npy", ZONES, ZONES)
+    dense = dense_matrix(make_matrix(), ZONES, ZONES)
+    assert not isinstance(dense, np.memmap)
+    np.testing.assert_array_equal(dense, open_matrix(tmp_path / "matrix0.npy"))
+    assert dense.dtype == np.uint8
+
+
+def test_rectangular_matrix(tmp_path):
+    matrix = make_matrix()
+    matrix = matrix[matrix["from_id"] == ZONES[1]].reset_index(drop=True)
+    write_zones(ZONES, tmp_path / "zones.csv", origins=[ZONES[1]])
+    origins, destinations = read_matrix_zones(tmp_path / "zones.csv")
+    assert origins.tolist() == [ZONES[1]]
+    assert destinations.tolist() == ZONES
+    write_matrix(matrix, tmp_path / "matrix0.npy", origins, destinations)
+    assert open_matrix(tmp_path / "matrix0.npy").shape == (1, 3)
+    result = read_matrix(tmp_path / "matrix0.npy", origins, destinations)
+    pd.testing.assert_frame_equal(result, matrix, check_dtype=False)
+
+
+def test_combine_matrices(tmp_path):
+    matrix = make_matrix()
+    matrix.loc[8, "travel_time"] = 300
+    for batch, origin in enumerate(ZONES):
+        rows = matrix[matrix["from_id"] == origin]
+        write_matrix(rows, tmp_path / f"batch{batch}.npy", [origin], ZONES)
+    paths = [tmp_path / f"batch{batch}.npy" for batch in range(3)]
+    combine_matrices(paths, tmp_path / "matrix0.npy")
+    assert open_matrix(tmp_path / "matrix0.npy").dtype == np.uint16
+    result = read_matrix(tmp_path / "matrix0.npy", ZONES, ZONES)
+    pd.testing.assert_frame_equal(result, matrix, check_dtype=False)
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+from tesca.metric_cache import MetricCache, column_hash
+
+
+def test_column_hash():
+    opportunity_df = pd.DataFrame(
+        {"bg_id": ["a", "b"], "jobs": [1, 2], "parks": [1, 2]}
+    )
+    assert column_hash(opportunity_df, "jobs") == column_hash(opportunity_df, "parks")
+    changed = opportunity_df.assign(jobs=[1, 3])
+    assert column_hash(changed, "jobs") != column_hash(opportunity_df, "jobs")
+
+
+def test_metric_cache(tmp_path):
+    cache = MetricCache(str(tmp_path / "metric_cache"))
+    keys = [MetricCache.key("matrix", "jobs", "cumulative", p) for p in [30, 45]]
+    assert keys[0] != keys[1]
+    assert cache.get(keys[0]) is None
+
+    cache.put(keys[0], np.arange(5))
+    cache.put(keys[1], np.arange(5) * 2)
+    np.testing.assert_array_equal(cache.get(keys[0]), np.arange(5))
+
+    cache.evict(keep={keys[1]})
+    assert cache.get(keys[0]) is None
+    np.testing.assert_array_equal(cache.get(keys[1]), np.arange(5) * 2)
@@ -1,9 +1,39 @@
+import numpy as np
+import pandas as pd
+
 from tesca.analysis import Analysis
 
+ZONES = ["010010201001", "010010201002", "010010201003"]
+
+
+def make_matrix():
+    return pd.DataFrame(
+        {
+            "from_id": np.repeat(ZONES, 3),
+            "to_id": np.tile(ZONES, 3),
+            "travel_time": [0, 20, 40, 20, 0, None, 40, None, 0],
+        }
+    )
+
+
+def make_opportunities(jobs):
+    return pd.DataFrame({"bg_id": ZONES, "jobs": jobs})
+
 
 def test_cumulative_measure():
-    assert Analysis.compute_cumulative_measure(30) == 60
+    result = Analysis.compute_cumulative_measure(
+        make_matrix(), make_opportunities([1, 2, 4]), "jobs", 30
+    )
+    assert list(result.columns) == ["bg_id", "jobs_c30"]
+    assert list(result["bg_id"]) == ZONES
+    assert list(result["jobs_c30"]) == [3, 3, 4]
 
 
 def test_travel_time_measure():
-    assert Analysis.compute_travel_time_measure(30) == 60
+    result = Analysis.compute_travel_time_measure(
+        make_matrix(), make_opportunities([1, 0, 1]), "jobs", 2
+    )
+    assert list(result.columns) == ["bg_id", "jobs_t2"]
+    assert list(result["bg_id"]) == ZONES
+    # The second origin cannot reach a second opportunity
+    np.testing.assert_array_equal(result["jobs_t2"], [40, np.nan, 40])
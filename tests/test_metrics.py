@@ -0,0 +1,225 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tesca.matrix import unreachable_value
+from tesca.metrics import (
+    MetricsEngine,
+    opportunity_matrix,
+    scenario_differences,
+    threshold_comparison,
+    travel_time_measures,
+    weighted_summaries,
+    write_access_curves,
+)
+
+
+def make_inputs(n=40, seed=0):
+    rng = np.random.default_rng(seed)
+    travel_times = rng.integers(0, 130, (n, n)).astype(np.uint8)
+    travel_times[rng.random((n, n)) < 0.2] = unreachable_value(np.uint8)
+    opportunities = rng.integers(0, 20, (n, 2)).astype("float64")
+    return travel_times, opportunities
+
+
+def make_zones(n):
+    return [f"{360470001000 + i:012d}" for i in range(n)]
+
+
+def test_opportunity_matrix():
+    a, b, c = "010010201001", "010010201002", "010010201003"
+    opportunity_df = pd.DataFrame({"bg_id": [a, b, "invalid"], "jobs": [3, 4, 5]})
+    result = opportunity_matrix(opportunity_df, [b, c, a], ["jobs"])
+    assert result.tolist() == [[4.0], [0.0], [3.0]]
+
+
+def test_cumulative():
+    travel_times, opportunities = make_inputs()
+    zones = make_zones(travel_times.shape[0])
+    opportunity_df = pd.DataFrame(
+        {"bg_id": zones, "jobs": opportunities[:, 0], "parks": opportunities[:, 1]}
+    )
+    engine = MetricsEngine(travel_times, zones, zones, opportunity_df, chunk_size=7)
+    thresholds = {"jobs": [0, 15, 30, 60, 300], "parks": [45, 15]}
+    result = engine.cumulative(thresholds)
+    reachable = travel_times != unreachable_value(travel_times.dtype)
+    for k, name in enumerate(thresholds):
+        for threshold in thresholds[name]:
+            within = reachable & (travel_times <= threshold)
+            expected = within.astype("float64") @ opportunities[:, k]
+            np.testing.assert_allclose(result[f"{name}_c{threshold}"], expected)
+
+
+def test_travel_time_measures():
+    travel_times, opportunities = make_inputs()
+    opportunities[opportunities < 15] = 0
+    ns = [[1, 3, 50], [2]]
+    result = travel_time_measures(travel_times, opportunities, ns, chunk_size=7)
+    reachable = travel_times != unreachable_value(travel_times.dtype)
+    for k, opportunity_ns in enumerate(ns):
+        for column, n in enumerate(opportunity_ns):
+            for origin in range(travel_times.shape[0]):
+                # The first whole minute at which n opportunities are reachable
+                expected = np.nan
+                for minute in range(256):
+                    within = reachable[origin] & (travel_times[origin] <= minute)
+                    if opportunities[within, k].sum() >= n:
+                        expected = minute
+                        break
+                np.testing.assert_equal(result[k][origin, column], expected)
+
+
+def test_metrics_engine():
+    travel_times, opportunities = make_inputs()
+    zones = make_zones(travel_times.shape[0])
+    opportunity_df = pd.DataFrame(
+        {
+            "bg_id": zones,
+            "jobs": opportunities[:, 0].astype(int),
+            "parks": opportunities[:, 1],
+        }
+    )
+    engine = MetricsEngine(
+        travel_times[:30], zones[:30], zones, opportunity_df, chunk_size=7
+    )
+    result = engine.compute(
+        {
+            "parks": {"method": "travel_time", "parameters": [1, 2]},
+            "jobs": {"method": "cumulative", "parameters": [30, 300]},
+        }
+    )
+    assert result.columns.tolist() == [
+        "bg_id",
+        "parks_t1",
+        "parks_t2",
+        "jobs_c30",
+        "jobs_c300",
+    ]
+    assert result["bg_id"].tolist() == zones[:30]
+    assert result["jobs_c30"].dtype == "int64"
+    reachable = travel_times[:30] != unreachable_value(travel_times.dtype)
+    for threshold in [30, 300]:
+        within = reachable & (travel_times[:30] <= threshold)
+        expected = within.astype("float64") @ opportunities[:, 0]
+        np.testing.assert_array_equal(result[f"jobs_c{threshold}"], expected)
+    times = travel_time_measures(travel_times[:30], opportunities[:, 1:], [[1, 2]])
+    np.testing.assert_array_equal(result[["parks_t1", "parks_t2"]], times[0])
+
+
+def test_metrics_engine_streaming():
+    travel_times, opportunities = make_inputs()
+    zones = make_zones(travel_times.shape[0])
+    opportunity_df = pd.DataFrame(
+        {"bg_id": zones, "jobs": opportunities[:, 0].astype(int)}
+    )
+    config = {
+        "jobs": {"method": "cumulative", "parameters": [15, 45]},
+        "jobs_nearest": {"method": "travel_time", "parameters": [3]},
+    }
+    opportunity_df["jobs_nearest"] = opportunity_df["jobs"]
+    engine = MetricsEngine(travel_times, zones, zones, opportunity_df, chunk_size=7)
+    chunks = list(engine.iter_compute(config))
+    assert [len(chunk) for chunk in chunks] == [7, 7, 7, 7, 7, 5]
+    streamed = "".join(
+        chunk.to_csv(index=False, header=idx == 0) for idx, chunk in enumerate(chunks)
+    )
+    assert streamed == engine.compute(config).to_csv(index=False)
+
+
+def test_scenario_differences():
+    values = np.random.default_rng(0).random((4, 10, 3))
+    pairs, differences = scenario_differences(values)
+    assert pairs == [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)]
+    for pair_idx, (a, b) in enumerate(pairs):
+        np.testing.assert_array_equal(differences[pair_idx], values[b] - values[a])
+
+
+def test_weighted_summaries():
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 60, (50, 2)).astype("float64")
+    values[5, 1] = np.nan
+    weights = rng.random((50, 3))
+    weights = weights / weights.sum(axis=0)
+    quantiles = [0.1, 0.5, 0.9]
+    means, result, edges, histograms = weighted_summaries(values, weights, quantiles, 6)
+    for metric in range(2):
+        valid = ~np.isnan(values[:, metric])
+        for group in range(3):
+            w = weights[valid, group]
+            v = values[valid, metric]
+            np.testing.assert_allclose(means[metric, group], (v * w).sum())
+            for q_idx, q in enumerate(quantiles):
+                # The smallest value with at least the quantile's share of weight
+                share = np.array([w[v <= x].sum() for x in v]) / w.sum()
+                expected = v[share >= q - 1e-12].min()
+                assert result[metric, group, q_idx] == expected
+            counts, _ = np.histogram(v, bins=edges[metric], weights=w)
+            np.testing.assert_allclose(histograms[metric, :, group], counts)
+
+
+def test_write_access_curves(tmp_path):
+    travel_times, opportunities = make_inputs()
+    path = tmp_path / "curves.npy"
+    write_access_curves(travel_times, opportunities, 150, path, chunk_size=7)
+    curves = np.load(path)
+    assert curves.shape == (travel_times.shape[0], 2, 151)
+    assert curves.dtype == np.uint32
+    reachable = travel_times != unreachable_value(travel_times.dtype)
+    for minute in [0, 15, 60, 128, 150]:
+        within = (reachable & (travel_times <= minute)).astype("float64")
+        np.testing.assert_allclose(curves[:, :, minute], within @ opportunities)
+
+    write_access_curves(travel_times, opportunities / 2, 150, path, chunk_size=7)
+    halved = np.load(path)
+    assert halved.dtype == np.float32
+    np.testing.assert_allclose(halved, curves / 2)
+
+
+def test_threshold_comparison(tmp_path):
+    travel_times, opportunities = make_inputs()
+    zones = make_zones(travel_times.shape[0])
+    paths = [tmp_path / "curves0.npy", tmp_path / "curves1.npy"]
+    write_access_curves(travel_times, opportunities, 120, paths[0])
+    write_access_curves(travel_times.T.copy(), opportunities, 120, paths[1])
+    config = {
+        "parks": {"method": "travel_time", "parameters": [1]},
+        "jobs": {"method": "cumulative", "parameters": [30]},
+        "schools": {"method": "cumulative", "parameters": [30]},
+    }
+    result = threshold_comparison(paths, zones, config, "schools", 45)
+    assert result.columns.tolist() == [
+        "bg_id",
+        "schools_c45_0",
+        "schools_c45_1",
+        "schools_c45_1-0",
+    ]
+    expected = np.load(paths[0])[:, 1, 45]
+    np.testing.assert_array_equal(result["schools_c45_0"], expected)
+    np.testing.assert_array_equal(
+        result["schools_c45_1-0"], np.load(paths[1])[:, 1, 45] - expected.astype(int)
+    )
+    for opportunity, threshold in [("parks", 45), ("schools", 121)]:
+        with pytest.raises(KeyError):
+            threshold_comparison(paths, zones, config, opportunity, threshold)
+
+
+def test_metrics_engine_float32():
+    travel_times, opportunities = make_inputs()
+    zones = make_zones(travel_times.shape[0])
+    opportunity_df = pd.DataFrame(
+        {"bg_id": zones, "jobs": opportunities[:, 0].astype(int)}
+    )
+    opportunity_df["jobs_nearest"] = opportunity_df["jobs"]
+    config = {
+        "jobs": {"method": "cumulative", "parameters": [15, 45]},
+        "jobs_nearest": {"method": "travel_time", "parameters": [3]},
+    }
+    wide = MetricsEngine(travel_times, zones, zones, opportunity_df, chunk_size=7)
+    lean = MetricsEngine(
+        travel_times, zones, zones, opportunity_df, chunk_size=7, dtype="float32"
+    )
+    expected = wide.compute(config)
+    result = lean.compute(config)
+    assert result["jobs_c15"].dtype == "int32"
+    assert result["jobs_nearest_t3"].dtype == "float32"
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
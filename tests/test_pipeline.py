@@ -0,0 +1,124 @@
+import os
+import shutil
+
+import pytest
+
+from tesca.analysis import COMPARED_FILENAME, PIPELINE_STAGES, Analysis
+
+
+@pytest.fixture
+def pipeline_analysis(analysis_config):
+    config = dict(
+        analysis_config,
+        verbosity="INFO",
+        infinity_value=999,
+        max_time_walking=30,
+        opportunities={"jobs": {"method": "cumulative", "parameters": [30]}},
+    )
+    for scenario in config["scenarios"]:
+        scenario["transit_modes"] = ["BUS"]
+    a = Analysis(config)
+    yield a
+    a.flush_artifacts()
+    shutil.rmtree(a.cache_folder)
+
+
+def stub_stages(monkeypatch, a, stages, during=None):
+    """Replace stages with stubs that record their runs and write their outputs"""
+    runs = []
+    for stage in stages:
+
+        def run(stage=stage):
+            runs.append(stage)
+            if during is not None:
+                during()
+            for filename in a.stage_dependencies(stage)[2]:
+                with open(os.path.join(a.cache_folder, filename), "w") as outfile:
+                    outfile.write(f"{stage}\n")
+
+        monkeypatch.setattr(a, stage, run)
+    return runs
+
+
+def write_file(a, filename, text):
+    with open(os.path.join(a.cache_folder, filename), "w") as outfile:
+        outfile.write(text)
+
+
+def run(a, stage, force=False):
+    ran = a.run_stage(stage, force=force)
+    a.flush_artifacts()
+    return ran
+
+
+def test_stage_skipped_when_unchanged(monkeypatch, pipeline_analysis):
+    a = pipeline_analysis
+    runs = stub_stages(monkeypatch, a, ["compare_scenarios"])
+    write_file(a, "metrics0.csv", "bg_id,jobs_c30\n")
+    assert run(a, "compare_scenarios") is True
+    assert run(a, "compare_scenarios") is False
+    assert runs == ["compare_scenarios"]
+
+
+def test_stage_rerun_when_input_changes(monkeypatch, pipeline_analysis):
+    a = pipeline_analysis
+    stub_stages(monkeypatch, a, ["compare_scenarios"])
+    write_file(a, "metrics0.csv", "bg_id,jobs_c30\n")
+    run(a, "compare_scenarios")
+    write_file(a, "metrics0.csv", "bg_id,jobs_c30\n010010201001,1\n")
+    assert run(a, "compare_scenarios") is True
+    assert run(a, "compare_scenarios") is False
+
+
+def test_stage_rerun_when_config_changes(monkeypatch, pipeline_analysis):
+    a = pipeline_analysis
+    stub_stages(monkeypatch, a, ["compare_scenarios"])
+    run(a, "compare_scenarios")
+    a.config["infinity_value"] = 1000
+    assert run(a, "compare_scenarios") is True
+    # Settings the stage does not read do not matter
+    a.config["max_time_walking"] = 20
+    assert run(a, "compare_scenarios") is False
+
+
+def test_stage_rerun_when_forced(monkeypatch, pipeline_analysis):
+    a = pipeline_analysis
+    runs = stub_stages(monkeypatch, a, ["compare_scenarios"])
+    run(a, "compare_scenarios")
+    assert run(a, "compare_scenarios", force=True) is True
+    assert runs == ["compare_scenarios", "compare_scenarios"]
+
+
+def test_stage_rerun_when_output_edited(monkeypatch, pipeline_analysis):
+    a = pipeline_analysis
+    stub_stages(monkeypatch, a, ["compare_scenarios"])
+    run(a, "compare_scenarios")
+    write_file(a, COMPARED_FILENAME, "edited by hand\n")
+    assert run(a, "compare_scenarios") is True
+
+
+def test_stage_rerun_when_input_changes_while_running(monkeypatch, pipeline_analysis):
+    a = pipeline_analysis
+    write_file(a, "metrics0.csv", "bg_id,jobs_c30\n")
+    stub_stages(
+        monkeypatch,
+        a,
+        ["compare_scenarios"],
+        during=lambda: write_file(
+            a, "metrics0.csv", "bg_id,jobs_c30\n010010201001,1\n"
+        ),
+    )
+    run(a, "compare_scenarios")
+    # The outputs were built from the old input, so the stage is out of date
+    assert run(a, "compare_scenarios") is True
+
+
+def test_pipeline_skips_up_to_date_stages(monkeypatch, pipeline_analysis):
+    a = pipeline_analysis
+    runs = stub_stages(monkeypatch, a, PIPELINE_STAGES)
+    a.run_pipeline()
+    assert runs == PIPELINE_STAGES
+    a.run_pipeline()
+    assert runs == PIPELINE_STAGES
+    a.run_pipeline(force=True)
+    assert runs == PIPELINE_STAGES * 2
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from tesca.zones import ZoneIndex, decode_geoids, encode_geoids
+
+
+def test_encode_geoids():
+    ids = ["010010201001", "360610001001", "3606100010", "abc"]
+    codes = encode_geoids(ids)
+    assert codes.tolist() == [10010201001, 360610001001, -1, -1]
+    assert decode_geoids(codes[:2]).tolist() == ids[:2]
+
+
+def test_zone_index():
+    index = ZoneIndex(["360610001002", "010010201001", "360610001001", "bad"])
+    assert len(index) == 4
+    positions = index.positions(["360610001001", "999999999999", "bad", "010010201001"])
+    assert positions.tolist() == [2, -1, -1, 1]
+    assert index.mask(["360610001002", "360610001001"]).tolist() == [
+        True,
+        False,
+        True,
+        False,
+    ]
+
+    df = pd.DataFrame({"bg_id": ["360610001001", "777777777777"], "jobs": [5, 6]})
+    values, present = index.align(df, ["jobs"])
+    np.testing.assert_array_equal(values[:, 0], [np.nan, np.nan, 5, np.nan])
+    assert present.tolist() == [False, False, True, False]